@@ -9,8 +9,10 @@ console = Console()
 main = cli = cyclopts.App(name="wwwmin-serve")
 config_cli = cyclopts.App(name="config")
 user_cli = cyclopts.App(name="user")
+db_cli = cyclopts.App(name="db")
 cli.command(user_cli)
 cli.command(config_cli)
+cli.command(db_cli)
 
 
 @cli.default()
@@ -26,6 +28,43 @@ def serve(config: str | None = None):
     wwwmin.server.serve()
 
 
+@cli.command()
+def export(outdir: Path, watch: bool = False, interval: float = 5.0):
+    """Pre-render the public pages and static assets into OUTDIR."""
+    import wwwmin.export
+
+    if watch:
+        try:
+            wwwmin.export.watch(outdir, interval)
+        except KeyboardInterrupt:
+            console.print("[red]Stopped.[/]")
+        return
+    for path in wwwmin.export.export(outdir):
+        console.print(f"[green]Wrote[/] {path}")
+
+
+@cli.command(name="export-data")
+def export_data(
+    table: Literal["submissions", "links", "categories"],
+    output: Path | None = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+):
+    """Stream TABLE as NDJSON or CSV to OUTPUT, or to stdout."""
+    import sys
+    import wwwmin.data_export
+
+    chunks = wwwmin.data_export.export(table, format, gzip)
+    if output is None:
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        return
+    with output.open("wb") as file:
+        for chunk in chunks:
+            file.write(chunk)
+    console.print(f"[green]Wrote[/] {output}")
+
+
 @config_cli.command()
 def show(format: Literal["json", "toml", "yaml"] = "toml"):
     import wwwmin.server
@@ -57,6 +96,20 @@ def create(username: str, password: str) -> None:
     console.print(wwwmin.security.User.create(username, password))
 
 
+@user_cli.command()
+def passwd(username: str, password: str) -> None:
+    import wwwmin.security
+
+    console.print(wwwmin.security.User.set_password(username, password))
+
+
+@user_cli.command()
+def delete(username: str) -> None:
+    import wwwmin.security
+
+    console.print(wwwmin.security.User.delete(username))
+
+
 @user_cli.command()
 def list() -> None:
     import wwwmin.security
@@ -64,5 +117,33 @@ def list() -> None:
     console.print(*wwwmin.security.User.iterall(), sep="\n")
 
 
+@db_cli.command()
+def migrate() -> None:
+    import wwwmin.migrations
+
+    for migration in wwwmin.migrations.migrate():
+        console.print(f"[green]Applied[/] {migration.version}: {migration.name}")
+    console.print(f"Schema version {wwwmin.migrations.current_version()}")
+
+
+@db_cli.command()
+def vacuum() -> None:
+    """Rebuild the database file, enabling incremental auto-vacuum on one
+    created without it. Run it once, while the server is stopped."""
+    import wwwmin.database
+
+    wwwmin.database.vacuum()
+    console.print("[green]Vacuumed[/] the database.")
+
+
+@db_cli.command()
+def compact() -> None:
+    """Move old archived submissions out of the live table."""
+    import wwwmin.retention
+
+    for segment, count in wwwmin.retention.compact():
+        console.print(f"[green]Compacted[/] {count} submissions into {segment}")
+
+
 if __name__ == "__main__":
     cli()
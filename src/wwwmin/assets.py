@@ -1,14 +1,36 @@
 from contextlib import asynccontextmanager
-from typing import Annotated
+from typing import Annotated, Any, Callable, Iterable
 from importlib.resources import files, as_file
+from pathlib import Path
 from urllib.parse import quote
+import hashlib
+import time
 
-from fastapi import APIRouter, Request, Depends, Query
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, HTTPException, Request, Depends, Query
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-
-from . import security, static, templates, database, operating_hours, links, submissions
+from jinja2 import FileSystemBytecodeCache
+from rich import print
+
+from . import (
+    security,
+    static,
+    templates,
+    database,
+    links,
+    submissions,
+    cache,
+    static_assets,
+)
+from .config import configconfig, config as main_config
+from .util import utcnow
+
+
+@configconfig.section("templates")
+class config:
+    bytecode_cache: bool = True
+    bytecode_cache_dir: Path = main_config().datadir / "jinja-cache"
+    warm_up: bool = True
 
 
 @asynccontextmanager
@@ -20,11 +42,60 @@ async def lifespan(app):
         as_file(static_files) as static_path,
         as_file(templates_files) as templates_path,
     ):
-        app.state.templates = Jinja2Templates(directory=templates_path)
-        app.mount("/", StaticFiles(directory=static_path), name="static")
+        manifest = static_assets.build(static_path)
+        app.state.templates = make_templates(templates_path, manifest)
+        if config().warm_up:
+            for name, elapsed in warm_up(app.state.templates).items():
+                print(f"[blue]Compiled[/] {name} in {elapsed * 1000:.1f}ms")
+        app.state.templates_version = templates_version(
+            app.state.templates, manifest.version
+        )
+        app.state.templates_loaded_at = utcnow()
+        app.mount(
+            "/",
+            static_assets.PrecompressedStaticFiles(
+                directory=manifest.directory, immutable=manifest.immutable
+            ),
+            name="static",
+        )
         yield
 
 
+def make_templates(
+    directory: Path, manifest: static_assets.Manifest
+) -> Jinja2Templates:
+    templates = Jinja2Templates(directory=directory)
+    templates.env.globals["asset"] = manifest.url
+    if config().bytecode_cache:
+        config().bytecode_cache_dir.mkdir(parents=True, exist_ok=True)
+        templates.env.bytecode_cache = FileSystemBytecodeCache(
+            str(config().bytecode_cache_dir)
+        )
+    return templates
+
+
+def warm_up(templates: Jinja2Templates) -> dict[str, float]:
+    """Compile every template ahead of the first request, returning the time
+    each one took."""
+    timings = {}
+    for name in templates.env.list_templates():
+        start = time.perf_counter()
+        templates.get_template(name)
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def templates_version(templates: Jinja2Templates, *extra: str) -> str:
+    env = templates.env
+    assert env.loader is not None
+    digest = hashlib.sha256("".join(extra).encode())
+    for name in env.list_templates():
+        source, _, _ = env.loader.get_source(env, name)
+        digest.update(name.encode())
+        digest.update(source.encode())
+    return digest.hexdigest()[:16]
+
+
 async def _depends_on_templates(request: Request):
     return request.app.state.templates
 
@@ -32,56 +103,144 @@ async def _depends_on_templates(request: Request):
 depends = Annotated[Jinja2Templates, Depends(_depends_on_templates)]
 
 
+async def render_cached(
+    templates: Jinja2Templates,
+    name: str,
+    context_factory: Callable[[], dict[str, Any]],
+    variant: str = "",
+    tags: Iterable[str] = (),
+) -> bytes:
+    async def render() -> bytes:
+        context = await database.run(context_factory)
+        return templates.get_template(name).render(context).encode()
+
+    return await cache.pages.aget_or_set((name, variant), render, tags=tags)
+
+
 api = APIRouter(lifespan=lifespan)
 
 
 @api.get("/", response_class=HTMLResponse)
-async def get_bare_index(
-    templates: depends,
-    request: Request,
-    operating: operating_hours.depends,
-):
-    return await get_index(templates, request, operating)
+async def get_bare_index(templates: depends, request: Request):
+    return await get_index(templates, request)
 
 
 @api.get("/index.html", response_class=HTMLResponse)
-async def get_index(
-    templates: depends,
-    request: Request,
-    _: operating_hours.depends,
-):
-    return templates.TemplateResponse(
-        request,
+async def get_index(templates: depends, request: Request):
+    # Only the first load needs the database pool.
+    directory = links.loaded()
+    if directory is None:
+        directory = await database.run(links.directory)
+    etag = cache.etag(
+        request.app.state.templates_version,
+        *directory.validator,
+        links.config().links,
+    )
+    # Templates and the links config change only on restart, so the page is
+    # never older than the templates were loaded.
+    last_modified = max(
+        filter(None, (directory.last_modified, request.app.state.templates_loaded_at))
+    )
+    if cache.is_fresh(request, etag, last_modified):
+        return cache.not_modified(etag, last_modified)
+    body = await render_cached(
+        templates,
         "index.html",
-        context={"links_by_category": links.get_contact_links()},
+        lambda: {"links_by_category": directory.public},
+        variant=str(directory.version),
+        tags={links.CACHE_TAG},
     )
+    return HTMLResponse(body, headers=cache.validators(etag, last_modified))
 
 
 @api.get("/login.html", response_class=HTMLResponse)
 async def get_login(
     templates: depends, request: Request, next: Annotated[str, Query()] = ""
 ):
-    return templates.TemplateResponse(
-        request, "login.html", context={"next_url": quote(next)}
+    next_url = quote(next)
+    return cache.conditional(
+        request,
+        cache.etag(request.app.state.templates_version, next_url),
+        None,
+        lambda: templates.TemplateResponse(
+            request, "login.html", context={"next_url": next_url}
+        ),
     )
 
 
+def _parse_cursor(value: str | None) -> submissions.Cursor | None:
+    if not value:
+        return None
+    try:
+        return submissions.Cursor.decode(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def _next_cursor(page: list[submissions.ContactFormSubmission], limit: int) -> str:
+    return page[-1].cursor.encode() if len(page) == limit else ""
+
+
+def _admin_context(
+    before: submissions.Cursor | None,
+    archived: bool,
+    archived_before: submissions.Cursor | None,
+    limit: int,
+    q: str = "",
+    offset: int = 0,
+) -> dict[str, Any]:
+    active = submissions.ContactFormSubmission.page(before=before, limit=limit)
+    directory = links.directory()
+    context = {
+        "links_by_category": directory.stored,
+        "categories": directory.categories,
+        "limit": limit,
+        "active_submissions": active,
+        "next_active": _next_cursor(active, limit),
+        "archived_submissions": None,
+        "next_archived": "",
+        "q": q,
+        "search_results": None,
+        "next_offset": None,
+    }
+    if q:
+        context["search_results"] = results = submissions.ContactFormSubmission.search(
+            q, offset=offset, limit=limit
+        )
+        if len(results) == limit:
+            context["next_offset"] = offset + limit
+    if archived:
+        context["archived_submissions"] = page = submissions.ContactFormSubmission.page(
+            "archived", before=archived_before, limit=limit
+        )
+        context["next_archived"] = _next_cursor(page, limit)
+    return context
+
+
 @api.get("/admin.html", response_class=HTMLResponse)
 async def get_admin(
     templates: depends,
     request: Request,
     _: security.authenticated,
+    before: Annotated[str | None, Query()] = None,
+    archived: Annotated[bool, Query()] = False,
+    archived_before: Annotated[str | None, Query()] = None,
+    limit: Annotated[int | None, Query()] = None,
+    q: Annotated[str, Query()] = "",
+    offset: Annotated[int, Query(ge=0)] = 0,
 ):
-    return templates.TemplateResponse(
-        request,
-        "admin.html",
-        context={
-            "links_by_category": links.ContactLink.group_by_category(),
-            "categories": database.connection.table(links.LinkCategory)
-            .select()
-            .execute()
-            .all(),
-            "active_submissions": submissions.ContactFormSubmission.active(),
-            "archived_submissions": submissions.ContactFormSubmission.archived(),
-        },
+    context = await database.run(
+        _admin_context,
+        _parse_cursor(before),
+        archived,
+        _parse_cursor(archived_before),
+        submissions.page_size(limit),
+        q.strip(),
+        offset,
+    )
+    context["request"] = request
+    # The queries above are bounded by `limit`; only rendering is streamed.
+    return StreamingResponse(
+        templates.get_template("admin.html").generate(context),
+        media_type="text/html",
     )
@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from threading import Lock
+from typing import Any, Awaitable, Callable, Hashable, Iterable
+import hashlib
+import time
+
+from fastapi import Request, Response
+
+from .config import configconfig
+
+
+@configconfig.section("cache")
+class config:
+    enabled: bool = True
+    max_entries: int = 256
+
+
+class TaggedCache:
+    """LRU cache whose entries can be dropped by tag instead of by key."""
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, tuple[Any, frozenset[str]]] = OrderedDict()
+        self._generation = 0
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = ()) -> None:
+        with self._lock:
+            self._set(key, value, tags)
+
+    def _set(self, key: Hashable, value: Any, tags: Iterable[str]) -> None:
+        self._entries[key] = (value, frozenset(tags))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_set(
+        self, key: Hashable, factory: Callable[[], Any], tags: Iterable[str] = ()
+    ) -> Any:
+        if not config().enabled:
+            return factory()
+        value = self.get(key)
+        if value is None:
+            generation = self._generation
+            value = factory()
+            self._set_if_current(key, value, tags, generation)
+        return value
+
+    async def aget_or_set(
+        self,
+        key: Hashable,
+        factory: Callable[[], Awaitable[Any]],
+        tags: Iterable[str] = (),
+    ) -> Any:
+        if not config().enabled:
+            return await factory()
+        value = self.get(key)
+        if value is None:
+            generation = self._generation
+            value = await factory()
+            self._set_if_current(key, value, tags, generation)
+        return value
+
+    def _set_if_current(
+        self, key: Hashable, value: Any, tags: Iterable[str], generation: int
+    ) -> None:
+        with self._lock:
+            # Don't store a value computed from data invalidated meanwhile.
+            if generation == self._generation:
+                self._set(key, value, tags)
+
+    def invalidate(self, *tags: str) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in [
+                key
+                for key, (_, entry_tags) in self._entries.items()
+                if not entry_tags.isdisjoint(tags)
+            ]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class ExpiringCache:
+    """LRU cache whose entries each carry their own expiry time, counting
+    hits and misses."""
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        if not config().enabled or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+pages = TaggedCache(config().max_entries)
+
+
+def etag(*parts: object) -> str:
+    digest = hashlib.sha256("\0".join(map(str, parts)).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def validators(etag: str, last_modified: datetime | None = None) -> dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True
+        )
+    return headers
+
+
+def is_fresh(
+    request: Request, etag: str, last_modified: datetime | None = None
+) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def not_modified(etag: str, last_modified: datetime | None = None) -> Response:
+    return Response(status_code=304, headers=validators(etag, last_modified))
+
+
+def conditional(
+    request: Request,
+    etag: str,
+    last_modified: datetime | None,
+    factory: Callable[[], Response],
+) -> Response:
+    if is_fresh(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    response = factory()
+    response.headers.update(validators(etag, last_modified))
+    return response
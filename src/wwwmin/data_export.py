@@ -0,0 +1,125 @@
+from typing import Annotated, AsyncIterator, Iterator, Literal
+import csv
+import io
+import json
+import zlib
+
+from fastapi import APIRouter, HTTPException, Path, Query
+from fastapi.responses import StreamingResponse
+
+from . import database, security
+from .config import configconfig
+
+# Tables are created by their modules.
+from . import links, submissions  # noqa: F401
+
+Format = Literal["ndjson", "csv"]
+TABLES = {
+    "submissions": "contact_form_submission",
+    "links": "contact_link",
+    "categories": "link_category",
+}
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@configconfig.section("data_export")
+class config:
+    chunk_size: int = 1000
+    compress_level: int = 6
+
+
+def _fetch(table: str, after: int, limit: int) -> tuple[list[str], list[tuple]]:
+    cursor = database.connection.cursor().execute(
+        f"SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?;", (after, limit)
+    )
+    return [column[0] for column in cursor.description], cursor.fetchall()
+
+
+class Encoder:
+    """Encodes chunks of rows as NDJSON or CSV, optionally gzipped, keeping no
+    more than one chunk in memory."""
+
+    def __init__(self, format: Format, compress: bool) -> None:
+        self.format = format
+        self._gzip = (
+            zlib.compressobj(config().compress_level, wbits=31) if compress else None
+        )
+        self._header = format == "csv"
+
+    def _compress(self, data: bytes) -> bytes:
+        return self._gzip.compress(data) if self._gzip else data
+
+    def encode(self, columns: list[str], rows: list[tuple]) -> bytes:
+        if self.format == "ndjson":
+            text = "".join(
+                json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+            )
+        else:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if self._header:
+                writer.writerow(columns)
+                self._header = False
+            writer.writerows(rows)
+            text = buffer.getvalue()
+        return self._compress(text.encode())
+
+    def finish(self) -> bytes:
+        return self._gzip.flush() if self._gzip else b""
+
+
+def export(
+    name: str, format: Format = "ndjson", compress: bool = False
+) -> Iterator[bytes]:
+    """Yield the rows of a table in `format`, one chunk at a time, walking it
+    in id order so each chunk is a short, separate query."""
+    encoder, after = Encoder(format, compress), 0
+    while True:
+        columns, rows = _fetch(TABLES[name], after, config().chunk_size)
+        if chunk := encoder.encode(columns, rows):
+            yield chunk
+        if len(rows) < config().chunk_size:
+            break
+        after = rows[-1][columns.index("id")]
+    yield encoder.finish()
+
+
+async def aexport(
+    name: str, format: Format = "ndjson", compress: bool = False
+) -> AsyncIterator[bytes]:
+    """Like `export`, running each query on the database pool."""
+    encoder, after = Encoder(format, compress), 0
+    while True:
+        columns, rows = await database.run(
+            _fetch, TABLES[name], after, config().chunk_size
+        )
+        if chunk := encoder.encode(columns, rows):
+            yield chunk
+        if len(rows) < config().chunk_size:
+            break
+        after = rows[-1][columns.index("id")]
+    yield encoder.finish()
+
+
+def filename(name: str, format: Format, compress: bool) -> str:
+    return f"{name}.{format}{'.gz' if compress else ''}"
+
+
+api = APIRouter()
+
+
+@api.get("/api/export/{name}")
+async def get_export(
+    _: security.authenticated,
+    name: Annotated[str, Path()],
+    format: Annotated[Format, Query()] = "ndjson",
+    gzip: Annotated[bool, Query()] = False,
+):
+    if name not in TABLES:
+        raise HTTPException(status_code=404, detail="Unknown export.")
+    disposition = f'attachment; filename="{filename(name, format, gzip)}"'
+    return StreamingResponse(
+        aexport(name, format, gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": disposition},
+    )
@@ -1,14 +1,199 @@
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Callable, get_args, get_type_hints
+import asyncio
+import functools
+import sqlite3
+import threading
 
 import appbase
 
 from wwwmin.config import configconfig, config as main_config
+from wwwmin.util import as_utc, parse_datetime
 
 
 @configconfig.section("database")
 class config:
     uri: Path | str = main_config().datadir / "database.sqlite3"
     echo: bool = False
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    cache_size: int = -16000
+    mmap_size: int = 128 * 1024 * 1024
+    busy_timeout: int = 5000
+    # Applies to new databases; run `wwwmin db vacuum` to apply it to an old one.
+    auto_vacuum: str = "INCREMENTAL"
+    readers: int = 4
 
 
-connection = appbase.database.connect(config().uri, echo=config().echo)
+def adapt_datetime(value: datetime) -> str:
+    """Store datetimes as UTC text with a fixed precision, so stored values
+    and bound parameters compare correctly as strings."""
+    return as_utc(value).isoformat(" ", timespec="microseconds")
+
+
+sqlite3.register_adapter(datetime, adapt_datetime)
+
+
+def _connect():
+    connection = appbase.database.connect(config().uri, echo=config().echo)
+    cursor = connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(config().busy_timeout)};")
+    if cursor.execute("PRAGMA page_count;").fetchone()[0] == 0:
+        # Only a new database can take it without a VACUUM, and setting it on
+        # an existing one can wait on the write lock.
+        cursor.execute(f"PRAGMA auto_vacuum = {config().auto_vacuum};")
+    cursor.execute(f"PRAGMA journal_mode = {config().journal_mode};")
+    cursor.execute(f"PRAGMA synchronous = {config().synchronous};")
+    cursor.execute(f"PRAGMA cache_size = {int(config().cache_size)};")
+    cursor.execute(f"PRAGMA mmap_size = {int(config().mmap_size)};")
+    return connection
+
+
+def _is_memory(uri: Path | str) -> bool:
+    return str(uri) == ":memory:" or "mode=memory" in str(uri)
+
+
+class ConnectionPool:
+    """One connection per thread, plus a single writer thread that owns the
+    only connection used for writes.
+
+    An in-memory database only exists on the connection that created it, so
+    then every thread shares one connection and writes run inline."""
+
+    def __init__(self, uri: Path | str) -> None:
+        self.shared = _connect() if _is_memory(uri) else None
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="wwwmin-db-writer",
+            initializer=self._mark_writer,
+        )
+        self._readers = ThreadPoolExecutor(
+            max_workers=config().readers, thread_name_prefix="wwwmin-db-reader"
+        )
+
+    def _mark_writer(self) -> None:
+        self._local.writer = True
+
+    def get(self):
+        if self.shared is not None:
+            return self.shared
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = _connect()
+        return connection
+
+    def write[T](self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self.shared is not None or getattr(self._local, "writer", False):
+            return fn(*args, **kwargs)
+        return self._writer.submit(fn, *args, **kwargs).result()
+
+    async def run[T](self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        call = functools.partial(_materialize, fn, *args, **kwargs)
+        if self.shared is not None:
+            return call()
+        return await asyncio.get_running_loop().run_in_executor(self._readers, call)
+
+    def close(self) -> None:
+        self._readers.shutdown()
+        self._writer.shutdown()
+
+
+def _materialize(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    # Lazy results must be consumed on the thread that owns the cursor.
+    result = fn(*args, **kwargs)
+    return list(result) if isinstance(result, Iterator) else result
+
+
+class _ThreadConnection:
+    def __getattr__(self, name: str) -> Any:
+        return getattr(pool.get(), name)
+
+
+pool = ConnectionPool(config().uri)
+connection: Any = _ThreadConnection()
+
+
+async def run[T](fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run blocking database work on the reader pool without blocking the
+    event loop. Iterators are returned as lists."""
+    return await pool.run(fn, *args, **kwargs)
+
+
+class AsyncRepository:
+    """Awaitable versions of a model's classmethods, under the same names:
+    `await Model.aio.get_by_id(1)` runs `Model.get_by_id(1)` on the pool."""
+
+    def __get__(self, instance: Any, owner: type) -> "_BoundRepository":
+        return _BoundRepository(owner)
+
+
+class _BoundRepository:
+    def __init__(self, model: type) -> None:
+        self.model = model
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        method = getattr(self.model, name)
+
+        @functools.wraps(method)
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await pool.run(method, *args, **kwargs)
+
+        return call
+
+
+def writes[**P, T](fn: Callable[P, T]) -> Callable[P, T]:
+    """Run the decorated function on the writer connection's thread."""
+
+    @functools.wraps(fn)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        return pool.write(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def _decode(hint: Any, value: Any) -> Any:
+    if isinstance(value, str) and datetime in (get_args(hint) or (hint,)):
+        return parse_datetime(value)
+    return value
+
+
+def query[T](cls: type[T], sql: str, *params: Any) -> Iterator[T]:
+    """Run raw SQL and build `cls` instances from the result columns, for
+    queries the table builder can't express."""
+    cursor = connection.cursor().execute(sql, params)
+    names = [column[0] for column in cursor.description]
+    hints = get_type_hints(cls)
+    for row in cursor:
+        yield cls(
+            **{name: _decode(hints.get(name), value) for name, value in zip(names, row)}
+        )
+
+
+@contextmanager
+def transaction() -> Iterator[Any]:
+    """Yield a cursor whose statements commit or roll back together.
+
+    Savepoints nest, and work whether or not a transaction is already open."""
+    cursor = connection.cursor()
+    cursor.execute("SAVEPOINT wwwmin;")
+    try:
+        yield cursor
+    except BaseException:
+        cursor.execute("ROLLBACK TO wwwmin;")
+        cursor.execute("RELEASE wwwmin;")
+        raise
+    cursor.execute("RELEASE wwwmin;")
+
+
+@writes
+def vacuum() -> None:
+    """Rebuild the database file, which also switches an existing database to
+    the configured `auto_vacuum` mode. Other connections wait until it's done."""
+    cursor = connection.cursor()
+    cursor.execute(f"PRAGMA auto_vacuum = {config().auto_vacuum};")
+    cursor.execute("VACUUM;")
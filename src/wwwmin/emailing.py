@@ -1,9 +1,12 @@
+from contextlib import asynccontextmanager
+import asyncio
 import sys
 import smtplib
 import email.message
 
 from fastapi import Request, FastAPI
 from fastapi.responses import PlainTextResponse
+from rich import print
 
 from .config import configconfig
 from . import submissions
@@ -17,6 +20,145 @@ class config:
     username: str = ""
     password: str = ""
     to: str = ""
+    starttls: bool = True
+    timeout: float = 30.0
+    connections: int = 1
+    queue_size: int = 100
+    keepalive: float = 60.0
+
+
+type Outgoing = tuple[email.message.EmailMessage, asyncio.Future[None] | None]
+
+
+class SMTPTransport:
+    """Sends queued messages over persistent, authenticated SMTP connections.
+
+    Each worker task owns one connection and drives the blocking smtplib calls
+    on a thread, so queueing a message never waits on the network. Idle
+    connections are kept alive with NOOP and reopened when the server drops
+    them."""
+
+    def __init__(self, connections: int = 1, queue_size: int = 100) -> None:
+        self.connections = connections
+        self.queue_size = queue_size
+        self._queue: asyncio.Queue[Outgoing] | None = None
+        self._workers: list[asyncio.Task] = []
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(config().host, config().port, timeout=config().timeout)
+        if config().starttls:
+            smtp.starttls()
+        if config().password:
+            smtp.login(config().username, config().password)
+        return smtp
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.quit()
+        except OSError:
+            smtp.close()
+
+    def _send(
+        self, smtp: smtplib.SMTP | None, msg: email.message.EmailMessage
+    ) -> smtplib.SMTP:
+        if smtp is not None:
+            try:
+                smtp.send_message(msg)
+                return smtp
+            except OSError:
+                # Likely dropped while idle; retry once on a fresh connection.
+                smtp.close()
+        smtp = self._connect()
+        try:
+            smtp.send_message(msg)
+        except OSError:
+            smtp.close()
+            raise
+        return smtp
+
+    def _noop(self, smtp: smtplib.SMTP) -> smtplib.SMTP | None:
+        try:
+            smtp.noop()
+            return smtp
+        except OSError:
+            smtp.close()
+            return None
+
+    async def _work(self, queue: asyncio.Queue[Outgoing]) -> None:
+        smtp: smtplib.SMTP | None = None
+        try:
+            while True:
+                try:
+                    msg, sent = await asyncio.wait_for(queue.get(), config().keepalive)
+                except TimeoutError:
+                    if smtp is not None:
+                        smtp = await asyncio.to_thread(self._noop, smtp)
+                    continue
+                try:
+                    smtp = await asyncio.to_thread(self._send, smtp, msg)
+                except Exception as exc:
+                    smtp = None
+                    if sent is None:
+                        print(f"[red]Failed to send email[/] {msg['Subject']!r}: {exc}")
+                    elif not sent.done():
+                        sent.set_exception(exc)
+                else:
+                    if sent is not None and not sent.done():
+                        sent.set_result(None)
+                finally:
+                    queue.task_done()
+        finally:
+            if smtp is not None:
+                self._close(smtp)
+
+    def _start(self) -> asyncio.Queue[Outgoing]:
+        if self._queue is None:
+            queue: asyncio.Queue[Outgoing] = asyncio.Queue(self.queue_size)
+            self._queue = queue
+            self._workers = [
+                asyncio.create_task(self._work(queue)) for _ in range(self.connections)
+            ]
+        return self._queue
+
+    def send_nowait(self, msg: email.message.EmailMessage) -> bool:
+        """Queue `msg` for delivery, returning False if the queue is full."""
+        try:
+            self._start().put_nowait((msg, None))
+        except asyncio.QueueFull:
+            print(f"[red]Email queue full, dropped[/] {msg['Subject']!r}")
+            return False
+        return True
+
+    async def send(self, msg: email.message.EmailMessage) -> None:
+        """Queue `msg`, waiting for room if needed, and wait until the server
+        has accepted it."""
+        sent = asyncio.get_running_loop().create_future()
+        await self._start().put((msg, sent))
+        await sent
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except TimeoutError:
+            pass
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queue, self._workers = None, []
+
+
+transport = SMTPTransport(config().connections, config().queue_size)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    try:
+        yield
+    finally:
+        await transport.stop()
 
 
 async def notify_submission(submission: submissions.ContactFormSubmission) -> None:
@@ -27,7 +169,9 @@ async def notify_submission(submission: submissions.ContactFormSubmission) -> No
         f'Contact Submission [{submission.id}] from [{submission.email or ""}|{submission.phone or ""}] at [{submission.received_at}]'
     )
     msg.set_content(submission.message)
-    await notify(msg)
+    # Delivered from the outbox, so wait for the server to accept it and let
+    # failures propagate to be retried.
+    await transport.send(msg)
 
 
 async def notify_exception(host, port, method, url, exc_type, exc_value, exc_tb):
@@ -42,10 +186,7 @@ async def notify_exception(host, port, method, url, exc_type, exc_value, exc_tb)
 async def notify(msg: email.message.EmailMessage):
     if not config().enabled:
         return
-    with smtplib.SMTP(config().host, config().port) as smtp:
-        smtp.starttls()
-        smtp.login(config().username, config().password)
-        smtp.send_message(msg)
+    transport.send_nowait(msg)
 
 
 async def notify_unhandled_exceptions_handler(
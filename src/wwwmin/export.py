@@ -0,0 +1,50 @@
+from importlib.resources import files, as_file
+from pathlib import Path
+from typing import Any, Callable, Iterator
+import time
+
+from rich import print
+
+from . import assets, links, operating_hours, static, static_assets, templates
+
+PAGES: dict[str, Callable[[], dict[str, Any]]] = {
+    "index.html": lambda: {"links_by_category": links.get_contact_links()},
+    "closed.html": lambda: {"schedule": list(operating_hours.iter_daily_parts())},
+    "login.html": lambda: {"next_url": ""},
+}
+LINK_PAGES = {"index.html"}
+
+
+def _render(outdir: Path, names: set[str]) -> Iterator[Path]:
+    with (
+        as_file(files(static)) as static_path,
+        as_file(files(templates)) as templates_path,
+    ):
+        manifest = static_assets.build(static_path, outdir, clean=False)
+        jinja = assets.make_templates(templates_path, manifest)
+        for name in sorted(names):
+            content = jinja.get_template(name).render(PAGES[name]()).encode()
+            if static_assets.write(outdir / name, content):
+                yield outdir / name
+
+
+def export(outdir: Path) -> list[Path]:
+    """Render the public pages and static assets into `outdir`, returning the
+    pages that changed."""
+    return list(_render(outdir, set(PAGES)))
+
+
+def watch(outdir: Path, interval: float = 5.0) -> None:
+    """Export once, then re-render the pages that depend on links whenever the
+    link data version changes."""
+    for path in export(outdir):
+        print(f"[green]Wrote[/] {path}")
+    version = links.directory().version
+    while True:
+        time.sleep(interval)
+        # Writes happen in the server process, so reload to see them.
+        if (current := links.reload().version) == version:
+            continue
+        version = current
+        for path in _render(outdir, LINK_PAGES):
+            print(f"[green]Wrote[/] {path}")
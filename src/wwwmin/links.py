@@ -1,16 +1,17 @@
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Annotated, Any, Iterator, Protocol, Self
-import itertools
+from types import MappingProxyType
+from typing import Annotated, Any, ClassVar, Iterator, Mapping, Protocol, Self
+import threading
 import pydantic
 
-from fastapi import APIRouter, Form
+from fastapi import APIRouter, Form, Request, Response
 from fastapi.responses import RedirectResponse
 import appbase
 
-from . import security, database
+from . import security, database, cache
 from .config import configconfig
-from .util import utcnow
+from .util import utcnow, as_utc, parse_datetime
 
 
 class CategoryType(Protocol):
@@ -43,6 +44,14 @@ class config:
     links: list[Link] = field(default_factory=list)
 
 
+CACHE_TAG = "links"
+
+
+def invalidate() -> None:
+    reload()
+    cache.pages.invalidate(CACHE_TAG)
+
+
 class LinkCategoryData(pydantic.BaseModel):
     name: str
     created_at: datetime = field(default_factory=utcnow)
@@ -56,6 +65,8 @@ class LinkCategory:
     created_at: datetime
     updated_at: datetime | None
 
+    aio: ClassVar[database.AsyncRepository] = database.AsyncRepository()
+
     @classmethod
     def get_by_id(cls, id: int) -> Self | None:
         return database.connection.table(cls).select().where(id=id).execute().one()
@@ -65,8 +76,9 @@ class LinkCategory:
         return database.connection.table(cls).select().where(name=name).execute().one()
 
     @classmethod
+    @database.writes
     def create(cls, **kwargs: Any) -> Self | None:
-        return (
+        category = (
             database.connection.table(cls)
             .insert()
             .values(LinkCategoryData(**kwargs))
@@ -74,13 +86,8 @@ class LinkCategory:
             .execute()
             .one()
         )
-
-    @classmethod
-    def group_by_id(cls) -> dict[int, Self]:
-        return {
-            link.id: link
-            for link in database.connection.table(cls).select().execute().iter()
-        }
+        invalidate()
+        return category
 
 
 class ContactLinkData(pydantic.BaseModel):
@@ -102,9 +109,12 @@ class ContactLink:
     created_at: datetime
     updated_at: datetime | None
 
+    aio: ClassVar[database.AsyncRepository] = database.AsyncRepository()
+
     @classmethod
+    @database.writes
     def create(cls, **kwargs: Any) -> Self | None:
-        return (
+        link = (
             database.connection.table(cls)
             .insert()
             .values(ContactLinkData(**kwargs))
@@ -112,32 +122,52 @@ class ContactLink:
             .execute()
             .one()
         )
+        invalidate()
+        return link
 
+    @database.writes
     def update(
         self,
         name: str | None = None,
         href: str | None = None,
         category_id: str | None = None,
     ) -> Self | None:
-        data = {}
+        data: dict[str, Any] = {}
         if name:
             data["name"] = name
         if href:
             data["href"] = href
         if category_id:
             data["category_id"] = category_id
-        return (
+        data["updated_at"] = utcnow()
+        link = (
             database.connection.table(type(self))
             .update()
             .set(data)
-            .where(id=id)
+            .where(id=self.id)
+            .returning("*")
             .execute()
             .one()
         )
+        invalidate()
+        return link
 
     @classmethod
-    def iter_all(cls) -> Iterator[Self]:
-        yield from database.connection.table(cls).select().execute().iter()
+    @database.writes
+    def update_by_id(
+        cls, id: int, name: str, href: str, category_id: int
+    ) -> Self | None:
+        link = (
+            database.connection.table(cls)
+            .update()
+            .set(name=name, href=href, category_id=category_id, updated_at=utcnow())
+            .where(id=id)
+            .returning("*")
+            .execute()
+            .one()
+        )
+        invalidate()
+        return link
 
     @classmethod
     def get_by_category(cls, category_id: int) -> Iterator[Self]:
@@ -149,30 +179,121 @@ class ContactLink:
             .iter()
         )
 
-    @classmethod
-    def group_by_category(cls) -> dict[int, list[Self]]:
-        table = database.connection.table(cls)
-        return {
-            key: list(group)
-            for key, group in itertools.groupby(
-                table.select().groupby("category_id").execute().iter(),
-                key=lambda row: row.category_id,
+
+@dataclass(frozen=True)
+class Directory:
+    """An immutable snapshot of every category and link. `version` increases
+    each time the stored links change."""
+
+    version: int
+    last_modified: datetime | None
+    categories: tuple[LinkCategory, ...]
+    links: tuple[ContactLink, ...]
+    # Stored links by category id, for editing. Names needn't be unique.
+    stored: Mapping[int, tuple[ContactLink, ...]]
+    # Stored and configured links by category, for display.
+    public: Mapping[Category, tuple[Link, ...]]
+
+    @property
+    def validator(self) -> tuple[int, int, datetime | None]:
+        return self.version, len(self.links), self.last_modified
+
+
+def _load() -> tuple[tuple[LinkCategory, ...], tuple[ContactLink, ...]]:
+    categories: dict[int, LinkCategory] = {}
+    links: list[ContactLink] = []
+    cursor = database.connection.cursor().execute(
+        """
+        SELECT
+            link_category.id, link_category.name,
+            link_category.created_at, link_category.updated_at,
+            contact_link.id, contact_link.name, contact_link.href,
+            contact_link.created_at, contact_link.updated_at
+        FROM link_category
+        LEFT JOIN contact_link ON contact_link.category_id = link_category.id
+        ORDER BY link_category.id, contact_link.id;
+        """
+    )
+    for row in cursor:
+        category_id = row[0]
+        if category_id not in categories:
+            categories[category_id] = LinkCategory(
+                category_id, row[1], parse_datetime(row[2]), parse_datetime(row[3])
+            )
+        if row[4] is not None:
+            links.append(
+                ContactLink(
+                    row[4],
+                    row[5],
+                    row[6],
+                    category_id,
+                    parse_datetime(row[7]),
+                    parse_datetime(row[8]),
+                )
             )
-        }
+    return tuple(categories.values()), tuple(links)
+
+
+def _build(
+    version: int,
+    categories: tuple[LinkCategory, ...],
+    links: tuple[ContactLink, ...],
+) -> Directory:
+    names = {category.id: category.name for category in categories}
+    stored: dict[int, list[ContactLink]] = {}
+    public: dict[Category, list[Link]] = {}
+    for link in links:
+        category = Category(names[link.category_id])
+        stored.setdefault(link.category_id, []).append(link)
+        public.setdefault(category, []).append(
+            Link(category.name, link.name, link.href)
+        )
+    for configured in config().links:
+        public.setdefault(Category(configured.category), []).append(configured)
+    rows: tuple[LinkCategory | ContactLink, ...] = (*categories, *links)
+    changes = [row.updated_at or row.created_at for row in rows]
+    return Directory(
+        version,
+        max(map(as_utc, changes), default=None),
+        categories,
+        links,
+        MappingProxyType({key: tuple(value) for key, value in stored.items()}),
+        MappingProxyType({key: tuple(value) for key, value in public.items()}),
+    )
 
 
-def get_contact_links() -> dict[Category, list[Link]]:
-    db_links = ContactLink.group_by_category()
-    db_categories = LinkCategory.group_by_id()
-    result = {}
-    for category_id, links in db_links.items():
-        category = db_categories[category_id]
-        result[Category(name=category.name)] = [
-            Link(category.name, link.name, link.href) for link in links
-        ]
-    for link in config().links:
-        result.setdefault(Category(name=link.category), []).append(link)
-    return result
+_directory: Directory | None = None
+_directory_lock = threading.Lock()
+
+
+def reload() -> Directory:
+    """Load the links from the database, replacing the current directory and
+    bumping its version if anything changed."""
+    global _directory
+    # Loading under the lock keeps a slow load from replacing a newer one.
+    with _directory_lock:
+        categories, links = _load()
+        current = _directory
+        if current is not None and (current.categories, current.links) == (
+            categories,
+            links,
+        ):
+            return current
+        _directory = _build(current.version + 1 if current else 1, categories, links)
+        return _directory
+
+
+def directory() -> Directory:
+    return _directory or reload()
+
+
+def loaded() -> Directory | None:
+    """The current directory, without touching the database."""
+    return _directory
+
+
+def get_contact_links() -> Mapping[Category, tuple[Link, ...]]:
+    return directory().public
 
 
 api = APIRouter()
@@ -183,7 +304,7 @@ async def post_category(
     _: security.authenticated,
     name: Annotated[str, Form()],
 ):
-    return LinkCategory.create(name=name)
+    return await LinkCategory.aio.create(name=name)
 
 
 @api.post("/form/links/categories")
@@ -191,7 +312,7 @@ async def post_category_form(
     _: security.authenticated,
     name: Annotated[str, Form()],
 ):
-    LinkCategory.create(name=name)
+    await LinkCategory.aio.create(name=name)
     return RedirectResponse("/admin.html", status_code=302)
 
 
@@ -202,7 +323,7 @@ async def post_link(
     href: Annotated[str, Form()],
     category_id: Annotated[int, Form()],
 ):
-    return ContactLink.create(name=name, href=href, category_id=category_id)
+    return await ContactLink.aio.create(name=name, href=href, category_id=category_id)
 
 
 @api.post("/form/links")
@@ -212,13 +333,18 @@ async def post_link_create_form(
     href: Annotated[str, Form()],
     category_id: Annotated[int, Form()],
 ):
-    ContactLink.create(name=name, href=href, category_id=category_id)
+    await ContactLink.aio.create(name=name, href=href, category_id=category_id)
     return RedirectResponse("/admin.html", status_code=302)
 
 
 @api.get("/api/links", response_model=list[ContactLink])
-async def get_links():
-    return list(ContactLink.iter_all())
+async def get_links(request: Request, response: Response):
+    links = await database.run(directory)
+    etag = cache.etag("/api/links", *links.validator)
+    if cache.is_fresh(request, etag, links.last_modified):
+        return cache.not_modified(etag, links.last_modified)
+    response.headers.update(cache.validators(etag, links.last_modified))
+    return links.links
 
 
 @api.post("/api/links/update", response_model=ContactLink)
@@ -229,14 +355,7 @@ async def update_link(
     href: Annotated[str, Form()],
     category_id: Annotated[int, Form()],
 ):
-    return (
-        database.connection.table(ContactLink)
-        .update()
-        .set(name=name, href=href, category_id=category_id)
-        .where(id=id)
-        .execute()
-        .one()
-    )
+    return await ContactLink.aio.update_by_id(id, name, href, category_id)
 
 
 @api.post("/form/links/update")
@@ -247,9 +366,7 @@ async def post_link_update_form(
     href: Annotated[str, Form()],
     category_id: Annotated[int, Form()],
 ):
-    database.connection.table(ContactLink).update().set(
-        name=name, href=href, category_id=category_id
-    ).where(id=id).execute()
+    await ContactLink.aio.update_by_id(id, name, href, category_id)
     return RedirectResponse("/admin.html", status_code=302)
 
 
@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator
+
+import appbase
+
+from . import database
+from .util import utcnow
+
+# Tables are created by their modules; migrations only change existing ones.
+from . import links, outbox, security, submissions, webpush  # noqa: F401
+
+
+@dataclass
+class SchemaMigration:
+    version: appbase.database.INTPK
+    name: str
+    applied_at: datetime
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    statements: tuple[str, ...]
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(
+        1,
+        "index contact_form_submission by archived_at, received_at",
+        (
+            "CREATE INDEX IF NOT EXISTS contact_form_submission_archived_at_received_at"
+            " ON contact_form_submission(archived_at, received_at, id);",
+            "CREATE INDEX IF NOT EXISTS contact_form_submission_received_at"
+            " ON contact_form_submission(received_at, id);",
+        ),
+    ),
+    Migration(
+        2,
+        "index contact_link by category_id",
+        (
+            "CREATE INDEX IF NOT EXISTS contact_link_category_id"
+            " ON contact_link(category_id);",
+        ),
+    ),
+    Migration(
+        3,
+        "index web_push_subscription by user_id",
+        (
+            "CREATE INDEX IF NOT EXISTS web_push_subscription_user_id"
+            " ON web_push_subscription(user_id);",
+        ),
+    ),
+    Migration(
+        4,
+        "index link_category by name",
+        ("CREATE INDEX IF NOT EXISTS link_category_name ON link_category(name);",),
+    ),
+    Migration(
+        5,
+        "index outbox_message by dead_at, next_attempt_at",
+        (
+            "CREATE INDEX IF NOT EXISTS outbox_message_dead_at_next_attempt_at"
+            " ON outbox_message(dead_at, next_attempt_at);",
+        ),
+    ),
+    Migration(
+        6,
+        "full-text index contact_form_submission",
+        (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS contact_form_submission_fts"
+            " USING fts5(email, phone, message,"
+            " content='contact_form_submission', content_rowid='id');",
+            "CREATE TRIGGER IF NOT EXISTS contact_form_submission_fts_insert"
+            " AFTER INSERT ON contact_form_submission BEGIN"
+            " INSERT INTO contact_form_submission_fts(rowid, email, phone, message)"
+            " VALUES (new.id, new.email, new.phone, new.message);"
+            " END;",
+            "CREATE TRIGGER IF NOT EXISTS contact_form_submission_fts_delete"
+            " AFTER DELETE ON contact_form_submission BEGIN"
+            " INSERT INTO contact_form_submission_fts"
+            "(contact_form_submission_fts, rowid, email, phone, message)"
+            " VALUES ('delete', old.id, old.email, old.phone, old.message);"
+            " END;",
+            "CREATE TRIGGER IF NOT EXISTS contact_form_submission_fts_update"
+            " AFTER UPDATE OF email, phone, message ON contact_form_submission BEGIN"
+            " INSERT INTO contact_form_submission_fts"
+            "(contact_form_submission_fts, rowid, email, phone, message)"
+            " VALUES ('delete', old.id, old.email, old.phone, old.message);"
+            " INSERT INTO contact_form_submission_fts(rowid, email, phone, message)"
+            " VALUES (new.id, new.email, new.phone, new.message);"
+            " END;",
+            "INSERT INTO contact_form_submission_fts(contact_form_submission_fts)"
+            " VALUES ('rebuild');",
+        ),
+    ),
+]
+
+
+def current_version() -> int:
+    (version,) = (
+        database.connection.cursor()
+        .execute("SELECT coalesce(max(version), 0) FROM schema_migration;")
+        .fetchone()
+    )
+    return version
+
+
+def pending() -> list[Migration]:
+    version = current_version()
+    return sorted(
+        (migration for migration in MIGRATIONS if migration.version > version),
+        key=lambda migration: migration.version,
+    )
+
+
+@database.writes
+def _apply(migration: Migration) -> None:
+    with database.transaction() as cursor:
+        for statement in migration.statements:
+            cursor.execute(statement)
+        cursor.execute(
+            "INSERT INTO schema_migration (version, name, applied_at)"
+            " VALUES (?, ?, ?);",
+            (migration.version, migration.name, utcnow()),
+        )
+
+
+def migrate() -> Iterator[Migration]:
+    """Apply pending migrations in order, each in its own transaction, and
+    yield them as they complete."""
+    for migration in pending():
+        _apply(migration)
+        yield migration
+
+
+database.connection.table(SchemaMigration).create().if_not_exists().execute()
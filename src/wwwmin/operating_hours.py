@@ -1,15 +1,21 @@
-from fastapi import Depends, Request, Response
-from fastapi.responses import JSONResponse
-from datetime import datetime, time
+from fastapi import Request, Response
+from fastapi.responses import HTMLResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from datetime import datetime, time, timedelta
+import bisect
+import functools
+import json
+import math
 import zoneinfo
 import calendar
 from dataclasses import field
-from typing import Iterator, Annotated
+from typing import Iterator, Literal, Self
 
 from fastapi import FastAPI
 from fastapi.templating import Jinja2Templates
 
 from .config import configconfig
+from . import cache
 
 
 @configconfig.section("operating_hours")
@@ -26,10 +32,133 @@ class config:
             "Sunday": None,
         }
     )
+    # ISO dates whose hours replace the weekly schedule. TOML has no null, so
+    # "closed" (or an empty list) closes the day.
+    overrides: dict[str, tuple[time, time] | Literal["closed"] | None] = field(
+        default_factory=dict
+    )
     tz_name: str = "America/New_York"
+    horizon_days: int = 14
+    # "METHOD /path" routes answered with the closed page outside of hours.
+    gated_routes: list[str] = field(
+        default_factory=lambda: [
+            "GET /",
+            "GET /index.html",
+            "GET /api/health",
+            "POST /api/submissions",
+            "POST /form/submissions",
+        ]
+    )
+
+
+@functools.cache
+def tz() -> zoneinfo.ZoneInfo:
+    return zoneinfo.ZoneInfo(config().tz_name)
+
+
+def overrides() -> dict[str, tuple[time, time] | None]:
+    """The configured overrides, with closed days as None."""
+    return {
+        day: None if hours == "closed" or hours == [] else hours
+        for day, hours in config().overrides.items()
+    }
+
+
+class Schedule:
+    """The opening and closing instants of every day from `start` for
+    `horizon_days`, as sorted timestamps. Days never span midnight, so the
+    website is closed at the start of each day."""
+
+    def __init__(self, start: datetime, instants: list[float], opens: list[bool]):
+        self.start = start.timestamp()
+        self.end = (start + timedelta(days=config().horizon_days)).timestamp()
+        self.instants = instants
+        self.opens = opens
+
+    @classmethod
+    def compile(cls, now: datetime) -> Self:
+        """Compile the schedule from midnight of `now`'s day, in `now`'s zone."""
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        instants: list[float] = []
+        opens: list[bool] = []
+        replaced = overrides()
+        for offset in range(config().horizon_days):
+            day = start + timedelta(days=offset)
+            hours = replaced.get(
+                day.date().isoformat(),
+                config().schedule.get(calendar.day_name[day.weekday()]),
+            )
+            match hours:
+                case None:
+                    continue
+                case (open_at, close_at):
+                    for at, is_open in ((open_at, True), (close_at, False)):
+                        instant = day.replace(hour=at.hour, minute=at.minute)
+                        instants.append(instant.timestamp())
+                        opens.append(is_open)
+                case _:
+                    raise ValueError("Invalid config schedule value.")
+        return cls(start, instants, opens)
+
+    def covers(self, timestamp: float) -> bool:
+        return self.start <= timestamp < self.end
+
+    def state_at(self, timestamp: float) -> tuple[bool, float, float]:
+        """Return whether the website is open at `timestamp`, and the
+        interval over which that holds."""
+        index = bisect.bisect_right(self.instants, timestamp)
+        is_open = self.opens[index - 1] if index else False
+        since = self.instants[index - 1] if index else self.start
+        until = self.instants[index] if index < len(self.instants) else self.end
+        return is_open, since, until
+
+    def next_open(self, timestamp: float) -> float | None:
+        index = bisect.bisect_right(self.instants, timestamp)
+        for instant, is_open in zip(self.instants[index:], self.opens[index:]):
+            if is_open:
+                return instant
+        return None
+
+
+_schedule: Schedule | None = None
+# Whether the website is open, and the interval [since, until) that holds for.
+_state: tuple[bool, float, float] = (False, math.inf, -math.inf)
+
+
+def _compiled(now: datetime) -> Schedule:
+    global _schedule
+    if _schedule is None or not _schedule.covers(now.timestamp()):
+        _schedule = Schedule.compile(now)
+    return _schedule
+
+
+def is_open_at(now: datetime) -> bool:
+    global _state
+    timestamp = now.timestamp()
+    is_open, since, until = _state
+    if since <= timestamp < until:
+        return is_open
+    _state = _compiled(now).state_at(timestamp)
+    return _state[0]
+
+
+def seconds_until_open(now: datetime) -> float | None:
+    """Return how long until the website next opens, if within the schedule
+    horizon."""
+    timestamp = _compiled(now).next_open(now.timestamp())
+    return None if timestamp is None else timestamp - now.timestamp()
 
 
 def iter_daily_parts() -> Iterator[tuple[str, str]]:
+    yield from _daily_parts()
+
+
+@functools.cache
+def _daily_parts() -> tuple[tuple[str, str], ...]:
+    return tuple(_iter_daily_parts())
+
+
+def _iter_daily_parts() -> Iterator[tuple[str, str]]:
     for day in range(7):
         day_name = calendar.day_name[day]
         match config().schedule.get(day_name):
@@ -53,6 +182,7 @@ def iter_daily_as_str() -> Iterator[str]:
                 yield f"{day_name} Closed"
 
 
+@functools.cache
 def to_simple_str() -> str:
     return ", ".join(iter_daily_as_str())
 
@@ -60,56 +190,65 @@ def to_simple_str() -> str:
 def open_now() -> bool:
     if not config().enabled:
         return True
-    now = datetime.now(zoneinfo.ZoneInfo(config().tz_name))
-    current_weekday = calendar.day_name[now.weekday()]
-    match config().schedule[current_weekday]:
-        case None:
-            return False
-        case (open_at, close_at):
-            return open_at <= now.time() <= close_at
-        case _:
-            raise ValueError("Invalid config schedule value.")
+    return is_open_at(datetime.now(tz()))
 
 
 def closed_index(templates: Jinja2Templates, request: Request) -> Response:
-    return templates.TemplateResponse(
-        request,
-        "closed.html",
-        {"schedule": iter_daily_parts()},
+    # Conditional requests don't apply to a 503, but the page only depends on
+    # the schedule so it's rendered once and tagged for clients and proxies.
+    body = cache.pages.get_or_set(
+        ("closed.html", ""),
+        lambda: templates.get_template("closed.html")
+        .render(schedule=iter_daily_parts())
+        .encode(),
+    )
+    return HTMLResponse(
+        body,
         status_code=503,
+        headers={
+            "ETag": cache.etag(request.app.state.templates_version, to_simple_str())
+        },
     )
 
 
-def closed_json() -> JSONResponse:
-    return JSONResponse(
-        content={
+@functools.cache
+def _closed_json_body() -> bytes:
+    return json.dumps(
+        {
             "status": "closed",
             "detail": f"This website is currently closed. Our operating hours are: {to_simple_str()}.",
-        },
-        status_code=503,
-    )
-
+        }
+    ).encode()
 
-class WebsiteClosedException(Exception):
-    pass
 
+def closed_json() -> Response:
+    return Response(_closed_json_body(), status_code=503, media_type="application/json")
 
-async def handle_closed_exception(request: Request, _: WebsiteClosedException):
-    accept = request.headers.get("accept", "text/html")
-    if "application/json" in accept:
-        return closed_json()
-    else:
-        return closed_index(request.app.state.templates, request)
 
+class ClosedMiddleware:
+    """Answers requests to `gated_routes` with the closed page while the
+    website is closed, before routing, dependencies or body parsing."""
 
-def install_exception_handler(app: FastAPI):
-    app.exception_handler(WebsiteClosedException)(handle_closed_exception)
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.routes = {tuple(route.split(" ", 1)) for route in config().gated_routes}
 
+    def _gated(self, scope: Scope) -> bool:
+        method = "GET" if scope["method"] == "HEAD" else scope["method"]
+        return (method, scope["path"]) in self.routes
 
-async def check_open() -> bool:
-    if not open_now():
-        raise WebsiteClosedException()
-    return True
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._gated(scope) or open_now():
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        if "application/json" in request.headers.get("accept", "text/html"):
+            response = closed_json()
+        else:
+            response = closed_index(request.app.state.templates, request)
+        if (wait := seconds_until_open(datetime.now(tz()))) is not None:
+            response.headers["Retry-After"] = str(math.ceil(wait))
+        await response(scope, receive, send)
 
 
-depends = Annotated[bool, Depends(check_open)]
+def install_middleware(app: FastAPI):
+    app.add_middleware(ClosedMiddleware)
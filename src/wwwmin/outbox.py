@@ -0,0 +1,210 @@
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Iterable, Self
+import asyncio
+
+import appbase
+from rich import print
+
+from . import database
+from .config import configconfig
+from .util import utcnow
+
+
+@configconfig.section("outbox")
+class config:
+    poll_interval: float = 5.0
+    batch_size: int = 50
+    concurrency: int = 8
+    max_attempts: int = 8
+    backoff_base: timedelta = timedelta(seconds=2)
+    backoff_max: timedelta = timedelta(hours=1)
+
+
+@dataclass
+class OutboxMessage:
+    id: appbase.database.INTPK
+    topic: str
+    payload_id: int
+    subscriber: str
+    attempts: int
+    created_at: datetime
+    next_attempt_at: datetime
+    last_error: str | None
+    dead_at: datetime | None
+
+    @classmethod
+    def due(cls, limit: int) -> list[Self]:
+        return list(
+            database.query(
+                cls,
+                """
+                SELECT * FROM outbox_message
+                WHERE dead_at IS NULL AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?;
+                """,
+                utcnow(),
+                limit,
+            )
+        )
+
+
+type Handler = Callable[[Any], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class Topic:
+    load: Callable[[int], Any]
+    subscribers: Callable[[], Iterable[Handler]]
+
+
+topics: dict[str, Topic] = {}
+
+
+def register(
+    topic: str,
+    load: Callable[[int], Any],
+    subscribers: Callable[[], Iterable[Handler]],
+) -> None:
+    """Deliver messages for `topic` by loading the payload row with `load` and
+    awaiting each of `subscribers` with it."""
+    topics[topic] = Topic(load, subscribers)
+
+
+def handler_name(handler: Handler) -> str:
+    return f"{handler.__module__}.{handler.__qualname__}"
+
+
+def enqueue(topic: str, payload_id: int, delay: timedelta = timedelta()) -> None:
+    """Record one message per subscriber of `topic`, first due after `delay`.
+    Call this inside the transaction that writes the payload so both commit
+    together."""
+    now = utcnow()
+    database.connection.cursor().executemany(
+        """
+        INSERT INTO outbox_message
+            (topic, payload_id, subscriber, attempts, created_at, next_attempt_at)
+        VALUES (?, ?, ?, 0, ?, ?);
+        """,
+        [
+            (topic, payload_id, handler_name(handler), now, now + delay)
+            for handler in topics[topic].subscribers()
+        ],
+    )
+
+
+def _backoff(attempts: int) -> timedelta:
+    return min(config().backoff_base * 2 ** (attempts - 1), config().backoff_max)
+
+
+@database.writes
+def _settle(delivered: list[int], failed: list[tuple[OutboxMessage, str]]) -> None:
+    now = utcnow()
+    with database.transaction() as cursor:
+        cursor.executemany(
+            "DELETE FROM outbox_message WHERE id = ?;", [(id,) for id in delivered]
+        )
+        for message, error in failed:
+            attempts = message.attempts + 1
+            cursor.execute(
+                """
+                UPDATE outbox_message
+                SET attempts = ?, last_error = ?, next_attempt_at = ?, dead_at = ?
+                WHERE id = ?;
+                """,
+                (
+                    attempts,
+                    error,
+                    now + _backoff(attempts),
+                    now if attempts >= config().max_attempts else None,
+                    message.id,
+                ),
+            )
+
+
+class OutboxWorker:
+    """Drains due outbox messages in batches, retrying failures with
+    exponential backoff and dead-lettering them after `max_attempts`."""
+
+    def __init__(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def _deliver(
+        self, message: OutboxMessage, limit: asyncio.Semaphore
+    ) -> str | None:
+        topic = topics.get(message.topic)
+        handlers = {
+            handler_name(handler): handler
+            for handler in (topic.subscribers() if topic else ())
+        }
+        if topic is None or message.subscriber not in handlers:
+            return f"No subscriber {message.subscriber} for {message.topic}."
+        payload = await database.run(topic.load, message.payload_id)
+        if payload is None:
+            return None  # The payload is gone; nothing left to deliver.
+        async with limit:
+            try:
+                await handlers[message.subscriber](payload)
+            except Exception as exc:
+                return f"{type(exc).__name__}: {exc}"
+        return None
+
+    async def drain(self) -> int:
+        """Deliver one batch of due messages, returning how many were tried."""
+        batch = await database.run(OutboxMessage.due, config().batch_size)
+        if not batch:
+            return 0
+        limit = asyncio.Semaphore(config().concurrency)
+        errors = await asyncio.gather(
+            *(self._deliver(message, limit) for message in batch)
+        )
+        delivered = [m.id for m, error in zip(batch, errors) if error is None]
+        failed = [(m, error) for m, error in zip(batch, errors) if error is not None]
+        for message, error in failed:
+            print(f"[red]Outbox delivery failed[/] {message.subscriber}: {error}")
+        await database.run(_settle, delivered, failed)
+        return len(batch)
+
+    async def run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.drain() == config().batch_size:
+                    continue
+            except Exception as exc:
+                print(f"[red]Outbox worker error[/] {exc}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), config().poll_interval)
+            except TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+worker = OutboxWorker()
+
+
+@asynccontextmanager
+async def lifespan(_):
+    worker.start()
+    try:
+        yield
+    finally:
+        await worker.stop()
+
+
+database.connection.table(OutboxMessage).create().if_not_exists().execute()
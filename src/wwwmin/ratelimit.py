@@ -0,0 +1,199 @@
+from collections import Counter, OrderedDict
+from dataclasses import field
+from datetime import timedelta
+from threading import Lock
+import json
+import math
+import time
+
+from fastapi import APIRouter
+from starlette.datastructures import Headers
+from starlette.formparsers import FormParser, MultiPartException, MultiPartParser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import security
+from .config import configconfig
+
+
+@configconfig.section("ratelimit")
+class config:
+    enabled: bool = True
+    # "METHOD /path": (requests, per period), counted per client address.
+    ip_limits: dict[str, tuple[int, timedelta]] = field(
+        default_factory=lambda: {
+            "POST /api/token": (10, timedelta(minutes=1)),
+            "POST /form/login": (10, timedelta(minutes=1)),
+            "POST /api/submissions": (5, timedelta(minutes=1)),
+            "POST /form/submissions": (5, timedelta(minutes=1)),
+        }
+    )
+    # "METHOD /path": (requests, per period), counted per submitted username.
+    username_limits: dict[str, tuple[int, timedelta]] = field(
+        default_factory=lambda: {
+            "POST /api/token": (5, timedelta(minutes=5)),
+            "POST /form/login": (5, timedelta(minutes=5)),
+        }
+    )
+    trust_forwarded_for: bool = False
+    max_keys: int = 10000
+    max_body_size: int = 4096
+
+
+class TokenBuckets:
+    """Token buckets keyed by client, refilled continuously at
+    `requests / period`. The least recently seen keys are forgotten first."""
+
+    def __init__(self, max_keys: int) -> None:
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[tuple[str, ...], tuple[float, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key: tuple[str, ...], requests: int, period: float) -> float:
+        """Spend one token, returning 0, or the seconds until one is available."""
+        rate = requests / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(requests), now))
+            tokens = min(float(requests), tokens + (now - updated) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+buckets = TokenBuckets(config().max_keys)
+allowed: Counter[str] = Counter()
+rejected: Counter[str] = Counter()
+
+
+def _client(scope: Scope) -> str:
+    if config().trust_forwarded_for:
+        forwarded = Headers(scope=scope).get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+async def _read_body(receive: Receive) -> tuple[list[Message], bytes | None]:
+    """Buffer the request body, or return None for it once it is past
+    `max_body_size`."""
+    messages: list[Message] = []
+    body = b""
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            return messages, body
+        body += message.get("body", b"")
+        if len(body) > config().max_body_size:
+            return messages, None
+        if not message.get("more_body", False):
+            return messages, body
+
+
+def _replay(messages: list[Message], receive: Receive) -> Receive:
+    pending = list(messages)
+
+    async def replay() -> Message:
+        if pending:
+            return pending.pop(0)
+        return await receive()
+
+    return replay
+
+
+async def _username(scope: Scope, body: bytes) -> str | None:
+    """Read `username` from a form body the way the route itself will."""
+    headers = Headers(scope=scope)
+    content_type = headers.get("content-type", "")
+
+    async def stream():
+        yield body
+
+    parser: FormParser | MultiPartParser
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        parser = FormParser(headers, stream())
+    elif content_type.startswith("multipart/form-data"):
+        parser = MultiPartParser(headers, stream())
+    else:
+        return None
+    try:
+        form = await parser.parse()
+    except MultiPartException:
+        return None
+    username = form.get("username")
+    await form.close()
+    return username.lower() if isinstance(username, str) else None
+
+
+class RateLimitMiddleware:
+    """Rejects requests over their route's budget with 429 before they reach
+    the handler, so no form parsing or password hashing is done for them.
+
+    Routes with a username limit also reject bodies over `max_body_size` with
+    413, since the username in them could not be counted."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = f"{scope['method']} {scope['path']}"
+        ip_limit = config().ip_limits.get(route)
+        username_limit = config().username_limits.get(route)
+        if ip_limit is None and username_limit is None:
+            return await self.app(scope, receive, send)
+
+        wait = 0.0
+        if ip_limit is not None:
+            requests, period = ip_limit
+            key = ("ip", route, _client(scope))
+            wait = buckets.take(key, requests, period.total_seconds())
+        if wait == 0 and username_limit is not None:
+            messages, body = await _read_body(receive)
+            if body is None:
+                rejected[route] += 1
+                return await _send_error(send, 413, "Request body too large.")
+            receive = _replay(messages, receive)
+            if (username := await _username(scope, body)) is not None:
+                requests, period = username_limit
+                key = ("username", route, username)
+                wait = buckets.take(key, requests, period.total_seconds())
+
+        if wait == 0:
+            allowed[route] += 1
+            return await self.app(scope, receive, send)
+        rejected[route] += 1
+        retry_after = str(math.ceil(wait)).encode()
+        await _send_error(
+            send, 429, "Too many requests.", (b"retry-after", retry_after)
+        )
+
+
+async def _send_error(
+    send: Send, status: int, detail: str, *headers: tuple[bytes, bytes]
+) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                *headers,
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+api = APIRouter()
+
+
+@api.get("/api/ratelimit/stats")
+async def get_stats(_: security.authenticated):
+    return {"allowed": dict(allowed), "rejected": dict(rejected)}
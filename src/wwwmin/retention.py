@@ -0,0 +1,162 @@
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Iterator, Self
+import asyncio
+import functools
+import gzip
+import json
+import os
+
+from fastapi import APIRouter, HTTPException
+import appbase
+from rich import print
+
+from . import database, security
+from .config import configconfig, config as main_config
+from .submissions import ContactFormSubmission
+from .util import parse_datetime, utcnow
+
+
+@configconfig.section("retention")
+class config:
+    enabled: bool = False
+    archive_after: timedelta = timedelta(days=365)
+    directory: Path = main_config().datadir / "archive"
+    segment_rows: int = 1000
+    interval: timedelta = timedelta(days=1)
+    vacuum_pages: int = 1000
+
+
+@dataclass
+class ColdSubmission:
+    """Where a submission moved out of the live table was written."""
+
+    id: appbase.database.INTPK
+    segment: str
+    line: int
+
+    @classmethod
+    def get_by_id(cls, id: int) -> Self | None:
+        return database.connection.table(cls).select().where(id=id).execute().one()
+
+
+def _expired(limit: int) -> list[ContactFormSubmission]:
+    return list(
+        database.query(
+            ContactFormSubmission,
+            """
+            SELECT * FROM contact_form_submission
+            WHERE archived_at IS NOT NULL AND archived_at < ?
+            ORDER BY id
+            LIMIT ?;
+            """,
+            utcnow() - config().archive_after,
+            limit,
+        )
+    )
+
+
+def _write_segment(rows: list[ContactFormSubmission]) -> str:
+    """Write `rows` as a gzipped NDJSON file that is never modified again."""
+    name = f"submissions-{rows[0].id}-{rows[-1].id}-{utcnow():%Y%m%dT%H%M%S}"
+    name += ".ndjson.gz"
+    lines = "".join(json.dumps(asdict(row), default=str) + "\n" for row in rows)
+    config().directory.mkdir(parents=True, exist_ok=True)
+    path = config().directory / name
+    tmp = path.with_name(f".{name}.tmp")
+    with tmp.open("wb") as file:
+        file.write(gzip.compress(lines.encode(), mtime=0))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+    return name
+
+
+@database.writes
+def _move(rows: list[ContactFormSubmission], segment: str) -> None:
+    # A crash before this commits leaves an unindexed segment behind, which is
+    # harmless: its rows are still live and will be written out again.
+    with database.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO cold_submission (id, segment, line) VALUES (?, ?, ?);",
+            [(row.id, segment, line) for line, row in enumerate(rows)],
+        )
+        cursor.executemany(
+            "DELETE FROM contact_form_submission WHERE id = ?;",
+            [(row.id,) for row in rows],
+        )
+
+
+@database.writes
+def _vacuum() -> None:
+    # A no-op unless the database uses incremental auto-vacuum, which new
+    # databases do; `wwwmin db vacuum` switches an older one over.
+    database.connection.cursor().execute(
+        f"PRAGMA incremental_vacuum({int(config().vacuum_pages)});"
+    ).fetchall()
+
+
+def compact() -> Iterator[tuple[str, int]]:
+    """Move archived submissions older than `archive_after` into segment
+    files, yielding each segment and its row count, then release freed pages."""
+    moved = False
+    while rows := _expired(config().segment_rows):
+        segment = _write_segment(rows)
+        _move(rows, segment)
+        moved = True
+        yield segment, len(rows)
+    if moved:
+        _vacuum()
+
+
+@functools.lru_cache(maxsize=8)
+def _read_segment(name: str) -> tuple[str, ...]:
+    with gzip.open(config().directory / name, "rt") as file:
+        return tuple(file)
+
+
+def get_cold(id: int) -> ContactFormSubmission | None:
+    location = ColdSubmission.get_by_id(id)
+    if location is None:
+        return None
+    data = json.loads(_read_segment(location.segment)[location.line])
+    for key in ("received_at", "archived_at"):
+        data[key] = parse_datetime(data[key])
+    return ContactFormSubmission(**data)
+
+
+async def run() -> None:
+    while True:
+        try:
+            for segment, count in await database.run(compact):
+                print(f"[blue]Compacted[/] {count} submissions into {segment}")
+        except Exception as exc:
+            print(f"[red]Retention error[/] {exc}")
+        await asyncio.sleep(config().interval.total_seconds())
+
+
+@asynccontextmanager
+async def lifespan(_):
+    task = asyncio.create_task(run()) if config().enabled else None
+    try:
+        yield
+    finally:
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+api = APIRouter()
+
+
+@api.get("/api/archive/submissions/{id}", response_model=ContactFormSubmission)
+async def get_cold_submission(_: security.authenticated, id: int):
+    submission = await database.run(get_cold, id)
+    if submission is None:
+        raise HTTPException(404, "Not Found.")
+    return submission
+
+
+database.connection.table(ColdSubmission).create().if_not_exists().execute()
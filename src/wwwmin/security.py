@@ -1,7 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import timedelta
-from typing import Annotated, Any, Iterator, Self
+from typing import Annotated, Any, Callable, ClassVar, Iterator, Self
 from urllib.parse import quote
+import asyncio
+import math
+import time
 
 import jwt
 import argon2
@@ -14,12 +18,12 @@ from fastapi import (
     Request,
     Depends,
 )
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import appbase
 
 from .util import utcnow
-from . import database
+from . import cache, database
 from .config import configconfig
 
 
@@ -27,10 +31,30 @@ from .config import configconfig
 class config:
     jwt_secret: str = "correct horse battery staple"
     jwt_ttl: timedelta = timedelta(days=30)
+    token_cache_size: int = 1024
+    token_cache_ttl: timedelta = timedelta(minutes=5)
+    # How often cached tokens are checked against user changes made by other
+    # processes sharing the database, such as the `user` CLI commands.
+    token_recheck_interval: timedelta = timedelta(seconds=1)
+    argon2_time_cost: int = argon2.DEFAULT_TIME_COST
+    argon2_memory_cost: int = argon2.DEFAULT_MEMORY_COST
+    argon2_parallelism: int = argon2.DEFAULT_PARALLELISM
+    hash_workers: int = 2
+    hash_queue_limit: int = 16
 
 
 api = APIRouter()
-hasher = argon2.PasswordHasher()
+hasher = argon2.PasswordHasher(
+    time_cost=config().argon2_time_cost,
+    memory_cost=config().argon2_memory_cost,
+    parallelism=config().argon2_parallelism,
+)
+# Verified tokens, mapped to their users and the AuthGeneration they were
+# verified under.
+tokens = cache.ExpiringCache(config().token_cache_size)
+# The newest AuthGeneration seen, and when it was last read.
+_generation = 0
+_generation_checked_at = -math.inf
 
 
 class AuthenticationError(Exception):
@@ -48,6 +72,40 @@ def _verify_password(hash: str, password: str) -> bool:
         raise AuthenticationError("Password mismatch.")
 
 
+class HashingOverloaded(Exception):
+    pass
+
+
+class HashingPool:
+    """Runs Argon2 on worker threads, at most `workers` at a time, and turns
+    callers away once `queue_limit` are already waiting for a slot."""
+
+    def __init__(self, workers: int, queue_limit: int) -> None:
+        self.queue_limit = queue_limit
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="wwwmin-argon2"
+        )
+
+    async def run[T](self, fn: Callable[..., T], *args: Any) -> T:
+        if self._slots.locked() and self.waiting >= self.queue_limit:
+            raise HashingOverloaded("Too many password checks in progress.")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._slots.release()
+
+
+hashing = HashingPool(config().hash_workers, config().hash_queue_limit)
+
+
 def _encode_token(user_id: int, scopes: set[str] | None = None) -> str:
     return jwt.encode(
         {
@@ -60,13 +118,13 @@ def _encode_token(user_id: int, scopes: set[str] | None = None) -> str:
     )
 
 
-def _decode_token(token: str) -> tuple[int, set[str] | None]:
+def _decode_token(token: str) -> tuple[int, set[str] | None, float]:
     try:
         data = jwt.decode(token, key=config().jwt_secret, algorithms=["HS256"])
         user_id = int(data["user"])
         scopes = data["scopes"]
         scopes = set(scopes.split(";")) if scopes != "" else None
-        return user_id, scopes
+        return user_id, scopes, float(data["exp"])
     except (jwt.DecodeError, AttributeError):
         raise AuthenticationError("Invalid token.")
 
@@ -81,12 +139,69 @@ class UserData:
         return _hash_password(self.password)
 
 
+@dataclass
+class AuthGeneration:
+    """A counter bumped whenever a user is created, deleted or changes
+    password, so every process sharing the database can tell its cached
+    tokens may be stale."""
+
+    id: appbase.database.INTPK
+    generation: int
+
+    @classmethod
+    def current(cls) -> int:
+        row = database.connection.table(cls).select().where(id=1).execute().one()
+        return row.generation if row else 0
+
+    @classmethod
+    def bump(cls) -> int:
+        (generation,) = (
+            database.connection.cursor()
+            .execute(
+                "INSERT INTO auth_generation (id, generation) VALUES (1, 1)"
+                " ON CONFLICT (id) DO UPDATE SET generation = generation + 1"
+                " RETURNING generation;"
+            )
+            .fetchone()
+        )
+        return generation
+
+
+def _observe(generation: int) -> None:
+    global _generation
+    _generation = max(_generation, generation)
+
+
+def _recheck_due() -> bool:
+    interval = config().token_recheck_interval.total_seconds()
+    return time.monotonic() - _generation_checked_at >= interval
+
+
+def _recheck() -> None:
+    """Forget every cached token if a user has changed since the last look."""
+    global _generation_checked_at
+    generation = AuthGeneration.current()
+    _generation_checked_at = time.monotonic()
+    if generation != _generation:
+        _observe(generation)
+        tokens.clear()
+
+
+def _changed[T](user: T | None) -> T | None:
+    """Record a change to `user`, if there was one, within its transaction."""
+    if user is not None:
+        _observe(AuthGeneration.bump())
+    return user
+
+
 @dataclass
 class User:
     id: appbase.database.INTPK
     username: Annotated[str, "UNIQUE"]
     password_hash: str
 
+    aio: ClassVar[database.AsyncRepository] = database.AsyncRepository()
+
     @classmethod
     def iterall(cls) -> Iterator[Self]:
         yield from database.connection.table(cls).select().execute().iter()
@@ -107,31 +222,106 @@ class User:
 
     @classmethod
     def create(cls, username: str, password: str) -> Self | None:
-        return (
+        # Hash before handing off so the writer thread isn't held by Argon2.
+        # A new user may reuse the id of a deleted one, so this counts as a
+        # change too.
+        return cls._insert(username, _hash_password(password))
+
+    @classmethod
+    @database.writes
+    def _insert(cls, username: str, password_hash: str) -> Self | None:
+        with database.transaction():
+            return _changed(
+                database.connection.table(cls)
+                .insert()
+                .values(username=username, password_hash=password_hash)
+                .returning("*")
+                .execute()
+                .one()
+            )
+
+    @classmethod
+    def set_password(cls, username: str, password: str) -> Self | None:
+        return cls._set_password_hash(username, _hash_password(password))
+
+    @classmethod
+    @database.writes
+    def _set_password_hash(cls, username: str, password_hash: str) -> Self | None:
+        with database.transaction():
+            return _changed(
+                database.connection.table(cls)
+                .update()
+                .set(password_hash=password_hash)
+                .where(username=username)
+                .returning("*")
+                .execute()
+                .one()
+            )
+
+    @classmethod
+    @database.writes
+    def delete(cls, username: str) -> Self | None:
+        with database.transaction():
+            deleted = list(
+                database.query(
+                    cls, "DELETE FROM user WHERE username = ? RETURNING *;", username
+                )
+            )
+            return _changed(deleted[0] if deleted else None)
+
+    @classmethod
+    @database.writes
+    def _update_password_hash(cls, id: int, password_hash: str) -> None:
+        (
             database.connection.table(cls)
-            .insert()
-            .values(username=username, password_hash=_hash_password(password))
-            .returning("*")
+            .update()
+            .set(password_hash=password_hash)
+            .where(id=id)
             .execute()
-            .one()
         )
 
     @classmethod
-    def authenticate_password(cls, username: str, password: str) -> Self:
-        user = cls.get_by_name(username)
+    async def authenticate_password(cls, username: str, password: str) -> Self:
+        user = await cls.aio.get_by_name(username)
         if not user:
             raise AuthenticationError("User not found.")
-        _verify_password(user.password_hash, password)
+        await hashing.run(_verify_password, user.password_hash, password)
+        if hasher.check_needs_rehash(user.password_hash):
+            # The password is only known now, so upgrade to the configured
+            # parameters while we have it.
+            user.password_hash = await hashing.run(_hash_password, password)
+            await cls.aio._update_password_hash(user.id, user.password_hash)
         return user
 
     @classmethod
     def authenticate_token(cls, token: Any) -> Self:
         if not isinstance(token, str):
             raise AuthenticationError("No authentication found.")
-        user_id, scopes = _decode_token(token)
+        if _recheck_due():
+            _recheck()
+        if (user := cls._cached(token)) is not None:
+            return user
+        return cls._authenticate_uncached(token)
+
+    @classmethod
+    def _cached(cls, token: str) -> Self | None:
+        entry = tokens.get(token)
+        if entry is None:
+            return None
+        user, generation = entry
+        # Verified before a user change that this process has since seen.
+        return user if generation == _generation else None
+
+    @classmethod
+    def _authenticate_uncached(cls, token: str) -> Self:
+        user_id, scopes, expires = _decode_token(token)
+        generation = AuthGeneration.current()
         user = cls.get_by_id(user_id)
         if not user:
             raise AuthenticationError("User not found.")
+        _observe(generation)
+        ttl = min(config().token_cache_ttl.total_seconds(), expires - time.time())
+        tokens.set(token, (user, generation), ttl)
         return user
 
     def encode_token(self, scopes: set[str] | None = None) -> str:
@@ -149,8 +339,17 @@ async def authenticate(
     cookie: Annotated[str | None, Cookie(alias="Authorization")] = None,
     header: Annotated[str | None, Depends(oauth2_scheme)] = None,
 ) -> User | None:
+    token = cookie or header
+    if not isinstance(token, str):
+        raise LoginRequired("Invalid authentication found.")
+    # Cache hits are answered here, without a trip to the database pool
+    # except to look for user changes every `token_recheck_interval`.
+    if _recheck_due():
+        await database.run(_recheck)
+    if (user := User._cached(token)) is not None:
+        return user
     try:
-        return User.authenticate_token(cookie or header)
+        return await User.aio._authenticate_uncached(token)
     except AuthenticationError:
         raise LoginRequired("Invalid authentication found.")
 
@@ -163,7 +362,7 @@ async def submit_login(form: Annotated[OAuth2PasswordRequestForm, Depends()]):
     username = form.username
     password = form.password
     try:
-        user = User.authenticate_password(username, password)
+        user = await User.authenticate_password(username, password)
     except AuthenticationError:
         raise HTTPException(status_code=400, detail="Authentication failed.")
     return {"access_token": user.encode_token(), "token_type": "bearer"}
@@ -176,7 +375,7 @@ async def submit_login_form(
     next: Annotated[str, Form()] = "/admin.html",
 ):
     try:
-        user = User.authenticate_password(username, password)
+        user = await User.authenticate_password(username, password)
     except AuthenticationError:
         return RedirectResponse(f"/login.html?next={next!r}", status_code=302)
     response = RedirectResponse("/admin.html", status_code=302)
@@ -191,6 +390,11 @@ async def submit_login_form(
     return response
 
 
+@api.get("/api/security/stats")
+async def get_stats(_: authenticated):
+    return {"token_cache": tokens.stats()}
+
+
 def handle_login_required(request: Request, _: LoginRequired):
     accept = request.headers.get("accept", "text/html")
     if "application/json" in accept:
@@ -198,8 +402,14 @@ def handle_login_required(request: Request, _: LoginRequired):
     return RedirectResponse(f"/login.html?next={quote(request.url._url)}")
 
 
+def handle_hashing_overloaded(request: Request, exc: HashingOverloaded):
+    return PlainTextResponse(str(exc), status_code=503, headers={"Retry-After": "1"})
+
+
 def install_exception_handler(app: FastAPI):
     app.exception_handler(LoginRequired)(handle_login_required)
+    app.exception_handler(HashingOverloaded)(handle_hashing_overloaded)
 
 
 database.connection.table(User).create().if_not_exists().execute()
+database.connection.table(AuthGeneration).create().if_not_exists().execute()
@@ -14,6 +14,11 @@ from . import (
     database,
     operating_hours,
     emailing,
+    migrations,
+    outbox,
+    ratelimit,
+    data_export,
+    retention,
 )
 from .config import configconfig
 
@@ -26,8 +31,19 @@ class config:
 
 @asynccontextmanager
 async def lifespan(_):
-    async with assets.lifespan(_):
-        yield
+    for migration in migrations.migrate():
+        print(f"[blue]Migrated[/] {migration.version}: {migration.name}")
+    try:
+        async with (
+            assets.lifespan(_),
+            emailing.lifespan(_),
+            outbox.lifespan(_),
+            submissions.lifespan(_),
+            retention.lifespan(_),
+        ):
+            yield
+    finally:
+        database.pool.close()
 
 
 api = FastAPI(lifespan=lifespan)
@@ -39,17 +55,22 @@ api.include_router(webpush.api)
 if github_webhook.config().enabled:
     api.include_router(github_webhook.api)
 api.include_router(assets.api)
+api.include_router(ratelimit.api)
+api.include_router(data_export.api)
+api.include_router(retention.api)
+if ratelimit.config().enabled:
+    api.add_middleware(ratelimit.RateLimitMiddleware)
 if emailing.config().enabled:
     emailing.install_exception_handler(api)
 if operating_hours.config().enabled:
-    operating_hours.install_exception_handler(api)
+    operating_hours.install_middleware(api)
 
 
 @api.get("/api/health")
-async def health_check(templates: assets.depends, _: operating_hours.depends):
+async def health_check(templates: assets.depends):
     try:
-        _ = (
-            database.connection.cursor()
+        _ = await database.run(
+            lambda: database.connection.cursor()
             .execute("select count(*) from user;")
             .fetchone()
         )
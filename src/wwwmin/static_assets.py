@@ -0,0 +1,199 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+from .config import configconfig, config as main_config
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+@configconfig.section("assets")
+class config:
+    build_dir: Path = main_config().datadir / "static-build"
+    brotli: bool = True
+    compress_min_size: int = 256
+
+
+# Service workers must be served from a stable URL to be updated in place.
+STABLE_NAMES = {"worker.js"}
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".html", ".json", ".txt"}
+CSS_URL = re.compile(r"""url\(\s*(["']?)([^"')]+)\1\s*\)""")
+# Lists the files the last cleaning build wrote, the only ones it may remove.
+BUILD_LIST = ".wwwmin-build"
+
+
+@dataclass(frozen=True)
+class Manifest:
+    directory: Path
+    paths: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def version(self) -> str:
+        digest = hashlib.sha256(repr(sorted(self.paths.items())).encode())
+        return digest.hexdigest()[:16]
+
+    @property
+    def immutable(self) -> frozenset[str]:
+        return frozenset(
+            fingerprinted
+            for name, fingerprinted in self.paths.items()
+            if fingerprinted != name
+        )
+
+    def url(self, name: str) -> str:
+        return self.paths.get(name, name)
+
+
+def _fingerprint(name: str, content: bytes) -> str:
+    if name in STABLE_NAMES:
+        return name
+    path = Path(name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+
+
+def _rewrite_css(content: bytes, paths: dict[str, str]) -> bytes:
+    def replace(match: re.Match[str]) -> str:
+        quote, url = match.groups()
+        return f"url({quote}{paths.get(url, url)}{quote})"
+
+    return CSS_URL.sub(replace, content.decode()).encode()
+
+
+def _replace(path: Path, content: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+
+
+def write(path: Path, content: bytes) -> bool:
+    """Atomically write `content` and its compressed variants to `path`,
+    skipping the write if the file is already up to date."""
+    if path.is_file() and path.read_bytes() == content:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _replace(path, content)
+    if path.suffix not in COMPRESSIBLE_SUFFIXES:
+        return True
+    if len(content) < config().compress_min_size:
+        return True
+    _replace(
+        path.with_name(path.name + ".gz"),
+        gzip.compress(content, compresslevel=9, mtime=0),
+    )
+    if brotli is not None and config().brotli:
+        _replace(path.with_name(path.name + ".br"), brotli.compress(content))
+    return True
+
+
+def _clean(target: Path, written: set[str]) -> None:
+    """Remove files the previous build wrote that this one didn't. Anything
+    else in `target` is left alone."""
+    build_list = target / BUILD_LIST
+    previous = build_list.read_text().splitlines() if build_list.is_file() else []
+    root = target.resolve()
+    for name in set(previous) - written:
+        path = target / name
+        if path.resolve().is_relative_to(root):
+            path.unlink(missing_ok=True)
+    _replace(build_list, "\n".join(sorted(written)).encode())
+
+
+def build(source: Path, target: Path | None = None, clean: bool = True) -> Manifest:
+    """Copy static files into `target` under content-hashed names, alongside
+    gzip/brotli variants, and return the mapping from original names.
+
+    With `clean`, files left over from the previous build are removed."""
+    target = target or config().build_dir
+    target.mkdir(parents=True, exist_ok=True)
+
+    files = sorted(
+        str(path.relative_to(source)) for path in source.rglob("*") if path.is_file()
+    )
+    # Stylesheets reference other assets, so they are hashed after rewriting.
+    files.sort(key=lambda name: name.endswith(".css"))
+    paths: dict[str, str] = {}
+    written: set[str] = set()
+    for name in files:
+        content = (source / name).read_bytes()
+        if name.endswith(".css"):
+            content = _rewrite_css(content, paths)
+        paths[name] = _fingerprint(name, content)
+        for output in {paths[name], name}:
+            write(target / output, content)
+            written.update(output + suffix for suffix in ("", ".gz", ".br"))
+    if clean:
+        _clean(target, written)
+    return Manifest(target, paths)
+
+
+def _accepted_encodings(header: str) -> set[str]:
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves `.br`/`.gz` siblings when the client accepts
+    them, and marks fingerprinted files as immutable."""
+
+    def __init__(self, *args, immutable: frozenset[str] = frozenset(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable = immutable
+
+    def file_response(
+        self,
+        full_path: str | os.PathLike[str],
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        media_type, _ = mimetypes.guess_type(str(full_path))
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        path, encoding = full_path, None
+        for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+            compressed = f"{full_path}{suffix}"
+            if candidate in accepted and os.path.isfile(compressed):
+                path, encoding = compressed, candidate
+                stat_result = os.stat(compressed)
+                break
+
+        response = FileResponse(
+            path,
+            status_code=status_code,
+            stat_result=stat_result,
+            media_type=media_type,
+        )
+        response.headers["Vary"] = "Accept-Encoding"
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        name = os.path.relpath(full_path, str(self.directory))
+        if name in self.immutable:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
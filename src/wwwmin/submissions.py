@@ -1,13 +1,77 @@
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from typing import Annotated, ClassVar, Iterator, Self, Callable, Awaitable
-from datetime import datetime
-
-from fastapi import APIRouter, BackgroundTasks, Body, Form, HTTPException
+from typing import (
+    Annotated,
+    Any,
+    ClassVar,
+    Iterator,
+    Literal,
+    NamedTuple,
+    Self,
+    Callable,
+    Awaitable,
+)
+from datetime import datetime, timedelta
+import asyncio
+import json
+import time
+
+from fastapi import (
+    APIRouter,
+    Body,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
 from fastapi.responses import RedirectResponse
 import appbase
 
-from . import security, database, operating_hours
-from .util import utcnow
+from . import security, database, outbox
+from .config import configconfig
+from .util import Latencies, utcnow, as_utc
+
+
+@configconfig.section("submissions")
+class config:
+    page_size: int = 50
+    max_page_size: int = 500
+    group_commit: bool = True
+    batch_window: timedelta = timedelta(milliseconds=5)
+    batch_size: int = 100
+    queue_size: int = 1000
+
+
+def page_size(limit: int | None) -> int:
+    return max(1, min(limit or config().page_size, config().max_page_size))
+
+
+OUTBOX_TOPIC = "submission"
+Status = Literal["active", "archived", "all"]
+
+
+class Cursor(NamedTuple):
+    """Keyset position of a submission in (received_at, id) order."""
+
+    received_at: datetime
+    id: int
+
+    def encode(self) -> str:
+        return f"{self.received_at.isoformat()}_{self.id}"
+
+    @classmethod
+    def decode(cls, value: str) -> Self:
+        received_at, _, id = value.rpartition("_")
+        return cls(datetime.fromisoformat(received_at), int(id))
+
+
+class NewSubmission(NamedTuple):
+    email: str
+    message: str
+    phone: str | None = None
+    received_at: datetime | None = None
+    archived_at: datetime | None = None
 
 
 @dataclass
@@ -20,6 +84,7 @@ class ContactFormSubmission:
     archived_at: datetime | None
 
     subscribers: ClassVar[set[Callable[[Self], Awaitable[None]]]] = set()
+    aio: ClassVar[database.AsyncRepository] = database.AsyncRepository()
 
     @classmethod
     def subscribe(
@@ -32,11 +97,8 @@ class ContactFormSubmission:
     def unsubscribe(cls, corofn: Callable[[Self], Awaitable[None]]) -> None:
         cls.subscribers.discard(corofn)  # type: ignore
 
-    def notify_in_backgroundtasks(self: Self, tasks: BackgroundTasks) -> None:
-        for corofn in self.subscribers:
-            tasks.add_task(corofn, self)
-
     @classmethod
+    @database.writes
     def create(
         cls,
         email: str,
@@ -45,47 +107,102 @@ class ContactFormSubmission:
         received_at: datetime | None = None,
         archived_at: datetime | None = None,
     ) -> Self | None:
-        return (
-            database.connection.table(cls)
-            .insert()
-            .values(
-                email=email,
-                message=message,
-                phone=phone,
-                received_at=received_at or utcnow(),
-                archived_at=archived_at,
-            )
-            .returning("*")
-            .execute()
-            .one()
-        )
+        new = NewSubmission(email, message, phone, received_at, archived_at)
+        created = cls.create_many([new])
+        return created[0] if created else None
+
+    @classmethod
+    @database.writes
+    def create_many(cls, new: list[NewSubmission]) -> list[Self]:
+        """Insert submissions in one transaction, so they share one commit."""
+        created = []
+        # The submissions and their notifications commit together, so a
+        # restart can't lose the notifications of a stored submission.
+        with database.transaction():
+            for email, message, phone, received_at, archived_at in new:
+                rows = database.query(
+                    cls,
+                    """
+                    INSERT INTO contact_form_submission
+                        (email, message, phone, received_at, archived_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    RETURNING *;
+                    """,
+                    email,
+                    message,
+                    phone,
+                    received_at or utcnow(),
+                    archived_at,
+                )
+                for submission in list(rows):
+                    outbox.enqueue(OUTBOX_TOPIC, submission.id)
+                    created.append(submission)
+        return created
 
     @classmethod
     def get_by_id(cls, id: int) -> Self | None:
         return database.connection.table(cls).select().where(id=id).execute().one()
 
     @classmethod
+    @database.writes
     def archive(cls, id: int) -> Self | None:
-        return (
-            database.connection.table(cls)
-            .update()
-            .set(archived_at=utcnow())
-            .where(id=id)
-            .returning("*")
-            .execute()
-            .one()
-        )
+        return cls._set_archived(True, id)
 
     @classmethod
+    @database.writes
     def unarchive(cls, id: int) -> Self | None:
-        return (
-            database.connection.table(cls)
-            .update()
-            .set(archived_at=None)
-            .where(id=id)
-            .execute()
-            .one()
+        return cls._set_archived(False, id)
+
+    @classmethod
+    def _set_archived(cls, archived: bool, id: int) -> Self | None:
+        updated = list(
+            database.query(
+                cls,
+                """
+                UPDATE contact_form_submission SET archived_at = ?
+                WHERE id = ?
+                RETURNING *;
+                """,
+                archived_at(archived),
+                id,
+            )
         )
+        return updated[0] if updated else None
+
+    @classmethod
+    @database.writes
+    def set_archived_many(
+        cls,
+        archived: bool,
+        ids: list[int] | None = None,
+        before: datetime | None = None,
+        text: str | None = None,
+    ) -> int:
+        """Archive or unarchive, in one transaction, the submissions matching
+        every given filter, returning how many changed."""
+        where = ["archived_at IS NULL" if archived else "archived_at IS NOT NULL"]
+        params: list = [archived_at(archived)]
+        if ids is not None:
+            where.append("id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(ids))
+        if before is not None:
+            where.append("received_at < ?")
+            params.append(as_utc(before))
+        if text is not None:
+            where.append(
+                "id IN (SELECT rowid FROM contact_form_submission_fts"
+                " WHERE contact_form_submission_fts MATCH ?)"
+            )
+            params.append(match_expression(text))
+        with database.transaction() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE contact_form_submission SET archived_at = ?
+                WHERE {" AND ".join(where)};
+                """,
+                params,
+            )
+            return cursor.rowcount
 
     @classmethod
     def archived(cls) -> Iterator[Self]:
@@ -107,52 +224,286 @@ class ContactFormSubmission:
             .iter()
         )
 
+    @property
+    def cursor(self) -> Cursor:
+        return Cursor(self.received_at, self.id)
+
+    @classmethod
+    def page(
+        cls,
+        status: Status = "active",
+        before: Cursor | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        limit: int = 50,
+    ) -> list[Self]:
+        """Return up to `limit` submissions older than `before`, newest first."""
+        where = {
+            "active": ["archived_at IS NULL"],
+            "archived": ["archived_at IS NOT NULL"],
+            "all": [],
+        }[status]
+        params: list = []
+        if before is not None:
+            where.append("(received_at, id) < (?, ?)")
+            params.extend(before)
+        if since is not None:
+            where.append("received_at >= ?")
+            params.append(as_utc(since))
+        if until is not None:
+            where.append("received_at < ?")
+            params.append(as_utc(until))
+        return list(
+            database.query(
+                cls,
+                f"""
+                SELECT * FROM contact_form_submission
+                WHERE {" AND ".join(where) or "1"}
+                ORDER BY received_at DESC, id DESC
+                LIMIT ?;
+                """,
+                *params,
+                limit,
+            )
+        )
+
+    @classmethod
+    def search(
+        cls,
+        text: str,
+        status: Status = "all",
+        offset: int = 0,
+        limit: int = 50,
+    ) -> list[Self]:
+        """Return submissions matching every word of `text`, best first."""
+        where = {
+            "active": ["archived_at IS NULL"],
+            "archived": ["archived_at IS NOT NULL"],
+            "all": [],
+        }[status]
+        if not (expression := match_expression(text)):
+            return []
+        return list(
+            database.query(
+                cls,
+                f"""
+                SELECT contact_form_submission.*
+                FROM contact_form_submission_fts
+                JOIN contact_form_submission
+                    ON contact_form_submission.id = contact_form_submission_fts.rowid
+                WHERE {" AND ".join(["contact_form_submission_fts MATCH ?", *where])}
+                ORDER BY contact_form_submission_fts.rank, contact_form_submission.id
+                LIMIT ? OFFSET ?;
+                """,
+                expression,
+                limit,
+                offset,
+            )
+        )
+
     @classmethod
     def iterall(cls) -> Iterator[Self]:
         yield from database.connection.table(cls).select().execute().iter()
 
 
+def archived_at(archived: bool) -> datetime | None:
+    """The archived_at every archive and unarchive path stores."""
+    return utcnow() if archived else None
+
+
+def match_expression(text: str) -> str:
+    """Quote each word of `text` so FTS5 matches it literally."""
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+type Pending = tuple[NewSubmission, float, asyncio.Future[ContactFormSubmission]]
+
+
+class Ingestor:
+    """Group-commits concurrent submissions.
+
+    Submissions arriving within `batch_window` of the first one in a batch are
+    inserted in a single transaction, and each caller is resolved once that
+    transaction has committed."""
+
+    def __init__(self) -> None:
+        self.batches = 0
+        self.rows = 0
+        self.row_latency = Latencies()
+        self.batch_latency = Latencies()
+        self._queue: asyncio.Queue[Pending] | None = None
+        self._task: asyncio.Task | None = None
+
+    async def submit(self, new: NewSubmission) -> ContactFormSubmission:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            if self._queue is None:
+                raise asyncio.QueueShutDown
+            await self._queue.put((new, time.perf_counter(), future))
+        except asyncio.QueueShutDown:
+            await self._commit([(new, time.perf_counter(), future)])
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue[Pending]) -> list[Pending]:
+        batch = [await queue.get()]
+        deadline = time.perf_counter() + config().batch_window.total_seconds()
+        while len(batch) < config().batch_size:
+            try:
+                batch.append(queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            if (remaining := deadline - time.perf_counter()) <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except (TimeoutError, asyncio.QueueShutDown):
+                break
+        return batch
+
+    async def _commit(self, batch: list[Pending]) -> None:
+        start = time.perf_counter()
+        try:
+            created = await ContactFormSubmission.aio.create_many(
+                [new for new, _, _ in batch]
+            )
+        except Exception as exc:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        end = time.perf_counter()
+        self.batches += 1
+        self.rows += len(created)
+        self.batch_latency.record(end - start)
+        for (_, queued_at, future), submission in zip(batch, created):
+            self.row_latency.record(end - queued_at)
+            if not future.done():
+                future.set_result(submission)
+
+    async def run(self, queue: asyncio.Queue[Pending]) -> None:
+        while True:
+            try:
+                batch = await self._collect(queue)
+            except asyncio.QueueShutDown:
+                return
+            await self._commit(batch)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(config().queue_size)
+            self._task = asyncio.create_task(self.run(self._queue))
+
+    async def stop(self) -> None:
+        """Commit everything already accepted, then stop batching."""
+        if self._task is None or self._queue is None:
+            return
+        self._queue.shutdown()
+        await self._task
+        self._queue, self._task = None, None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "row_latency_ms": self.row_latency.summary(),
+            "batch_latency_ms": self.batch_latency.summary(),
+        }
+
+
+ingestor = Ingestor()
+
+
+@asynccontextmanager
+async def lifespan(_):
+    if config().group_commit:
+        ingestor.start()
+    try:
+        yield
+    finally:
+        await ingestor.stop()
+
+
 api = APIRouter()
 
 
 @api.post("/api/submissions", status_code=201, response_model=ContactFormSubmission)
 async def post_submission(
-    _: operating_hours.depends,
-    tasks: BackgroundTasks,
     email: Annotated[str, Form()],
     message: Annotated[str, Form()],
     phone: Annotated[str | None, Form()] = None,
 ):
-    submission = ContactFormSubmission.create(email=email, message=message, phone=phone)
-    if submission is None:
+    try:
+        submission = await ingestor.submit(NewSubmission(email, message, phone))
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to create submission.")
-    submission.notify_in_backgroundtasks(tasks)
+    outbox.worker.wake()
     return submission
 
 
 @api.post("/form/submissions")
 async def post_submission_form(
-    _: operating_hours.depends,
-    tasks: BackgroundTasks,
     email: Annotated[str, Form()],
     message: Annotated[str, Form()],
     phone: Annotated[str | None, Form()] = None,
 ):
-    submission = ContactFormSubmission.create(email=email, message=message, phone=phone)
-    if submission is None:
+    try:
+        await ingestor.submit(NewSubmission(email, message, phone))
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to create submission.")
-    submission.notify_in_backgroundtasks(tasks)
+    outbox.worker.wake()
     return RedirectResponse("/", status_code=302)
 
 
+@api.get("/api/submissions/ingest-stats")
+async def get_ingest_stats(_: security.authenticated):
+    return ingestor.stats()
+
+
 @api.get("/api/submissions", response_model=list[ContactFormSubmission])
-async def get_submissions(_: security.authenticated):
-    return list(ContactFormSubmission.iterall())
+async def get_submissions(
+    _: security.authenticated,
+    request: Request,
+    response: Response,
+    limit: Annotated[int | None, Query()] = None,
+    after: Annotated[str | None, Query()] = None,
+    status: Annotated[Status, Query()] = "all",
+    since: Annotated[datetime | None, Query()] = None,
+    until: Annotated[datetime | None, Query()] = None,
+):
+    try:
+        before = Cursor.decode(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    limit = page_size(limit)
+    page = await ContactFormSubmission.aio.page(status, before, since, until, limit)
+    if len(page) == limit:
+        next_url = request.url.include_query_params(after=page[-1].cursor.encode())
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return page
+
+
+@api.get("/api/submissions/search", response_model=list[ContactFormSubmission])
+async def search_submissions(
+    _: security.authenticated,
+    request: Request,
+    response: Response,
+    q: Annotated[str, Query()],
+    status: Annotated[Status, Query()] = "all",
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int | None, Query()] = None,
+):
+    limit = page_size(limit)
+    results = await ContactFormSubmission.aio.search(q, status, offset, limit)
+    if len(results) == limit:
+        next_url = request.url.include_query_params(offset=offset + limit)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return results
 
 
 @api.post("/api/submissions/archive", status_code=200)
 async def archive_submission(_: security.authenticated, id: Annotated[int, Body()]):
-    submission = ContactFormSubmission.archive(id)
+    submission = await ContactFormSubmission.aio.archive(id)
     if not submission:
         raise HTTPException(404, "Submission not Found.")
     return submission
@@ -162,17 +513,51 @@ async def archive_submission(_: security.authenticated, id: Annotated[int, Body(
 async def post_unarchive_submission(
     _: security.authenticated, id: Annotated[int, Body()]
 ):
-    submission = ContactFormSubmission.unarchive(id)
+    submission = await ContactFormSubmission.aio.unarchive(id)
     if not submission:
         raise HTTPException(404, "Not Found.")
     return submission
 
 
+def _bulk_filters(
+    ids: list[int] | None, before: datetime | None, q: str | None
+) -> dict[str, Any]:
+    if q is not None and not match_expression(q):
+        raise HTTPException(status_code=400, detail="Empty search.")
+    if ids is None and before is None and q is None:
+        raise HTTPException(status_code=400, detail="No ids or filters given.")
+    return {"ids": ids, "before": before, "text": q}
+
+
+@api.post("/api/submissions/archive/bulk")
+async def post_archive_submissions(
+    _: security.authenticated,
+    ids: Annotated[list[int] | None, Body()] = None,
+    before: Annotated[datetime | None, Body()] = None,
+    q: Annotated[str | None, Body()] = None,
+):
+    filters = _bulk_filters(ids, before, q)
+    count = await ContactFormSubmission.aio.set_archived_many(True, **filters)
+    return {"archived": count}
+
+
+@api.post("/api/submissions/unarchive/bulk")
+async def post_unarchive_submissions(
+    _: security.authenticated,
+    ids: Annotated[list[int] | None, Body()] = None,
+    before: Annotated[datetime | None, Body()] = None,
+    q: Annotated[str | None, Body()] = None,
+):
+    filters = _bulk_filters(ids, before, q)
+    count = await ContactFormSubmission.aio.set_archived_many(False, **filters)
+    return {"unarchived": count}
+
+
 @api.post("/form/submissions/archive")
 async def post_archive_submission_form(
     _: security.authenticated, id: Annotated[int, Form()]
 ):
-    submission = ContactFormSubmission.archive(id)
+    submission = await ContactFormSubmission.aio.archive(id)
     if not submission:
         raise HTTPException(404, "Not Found.")
     return RedirectResponse("/admin.html", status_code=302)
@@ -182,10 +567,33 @@ async def post_archive_submission_form(
 async def post_unarchive_submission_form(
     _: security.authenticated, id: Annotated[int, Form()]
 ):
-    submission = ContactFormSubmission.unarchive(id)
+    submission = await ContactFormSubmission.aio.unarchive(id)
     if not submission:
         raise HTTPException(404, "Not Found.")
     return RedirectResponse("/admin.html", status_code=302)
 
 
+@api.post("/form/submissions/archive/bulk")
+async def post_archive_submissions_form(
+    _: security.authenticated, ids: Annotated[list[int], Form()] = []
+):
+    if ids:
+        await ContactFormSubmission.aio.set_archived_many(True, ids=ids)
+    return RedirectResponse("/admin.html", status_code=302)
+
+
+@api.post("/form/submissions/unarchive/bulk")
+async def post_unarchive_submissions_form(
+    _: security.authenticated, ids: Annotated[list[int], Form()] = []
+):
+    if ids:
+        await ContactFormSubmission.aio.set_archived_many(False, ids=ids)
+    return RedirectResponse("/admin.html?archived=true", status_code=302)
+
+
 database.connection.table(ContactFormSubmission).create().if_not_exists().execute()
+outbox.register(
+    OUTBOX_TOPIC,
+    ContactFormSubmission.get_by_id,
+    lambda: ContactFormSubmission.subscribers,
+)
@@ -1,5 +1,57 @@
+from collections import deque
 from datetime import datetime, timezone
+from threading import Lock
+from typing import overload
+import statistics
 
 
 def utcnow() -> datetime:
     return datetime.now(tz=timezone.utc)
+
+
+def as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+@overload
+def parse_datetime(value: datetime | str) -> datetime: ...
+
+
+@overload
+def parse_datetime(value: None) -> None: ...
+
+
+@overload
+def parse_datetime(value: datetime | str | None) -> datetime | None: ...
+
+
+def parse_datetime(value: datetime | str | None) -> datetime | None:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class Latencies:
+    """The most recent `size` durations, in seconds, summarized in ms."""
+
+    def __init__(self, size: int = 1000) -> None:
+        self._samples: deque[float] = deque(maxlen=size)
+        self._lock = Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def summary(self) -> dict[str, float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {}
+        return {
+            "mean": statistics.fmean(samples) * 1000,
+            "p50": samples[len(samples) // 2] * 1000,
+            "p95": samples[int(len(samples) * 0.95)] * 1000,
+            "max": samples[-1] * 1000,
+        }
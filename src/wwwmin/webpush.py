@@ -1,19 +1,26 @@
-from dataclasses import dataclass
-from typing import Annotated, Any, Iterator, Self
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Annotated, Any, ClassVar, Iterator, Literal, Self
 from pathlib import Path
+from urllib.parse import urlsplit
+import asyncio
 import json
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 
 from fastapi import APIRouter, Body
 from fastapi.responses import PlainTextResponse
 import py_vapid
 from pywebpush import webpush, WebPushException
+from requests.adapters import HTTPAdapter
 import appbase
+import requests
 
-from . import security, database
+from . import security, database, outbox
 from .submissions import ContactFormSubmission
 from .config import configconfig, config as main_config
-from .util import utcnow
+from .util import Latencies, utcnow
 from wwwmin import submissions
 
 
@@ -21,6 +28,10 @@ from wwwmin import submissions
 class config:
     enabled: bool = False
     vapid_private_key_file: Path = main_config().datadir / "vapid-private-key.pem"
+    concurrency: int = 16
+    timeout: float = 10.0
+    vapid_subject: str = "mailto:push@aidan.software"
+    vapid_token_lifetime: timedelta = timedelta(hours=12)
 
 
 @dataclass
@@ -30,7 +41,10 @@ class WebPushSubscription:
     subscription: str
     subscribed_at: datetime
 
+    aio: ClassVar[database.AsyncRepository] = database.AsyncRepository()
+
     @classmethod
+    @database.writes
     def subscribe_user(
         cls, user_id: int, subscription: str, subscribed_at: datetime | None = None
     ) -> Self | None:
@@ -57,10 +71,75 @@ class WebPushSubscription:
             .iter()
         )
 
+    @classmethod
+    def get_by_id(cls, id: int) -> Self | None:
+        return database.connection.table(cls).select().where(id=id).execute().one()
+
     @classmethod
     def iterall(cls) -> Iterator[Self]:
         yield from (database.connection.table(cls).select().execute().iter())
 
+    @classmethod
+    @database.writes
+    def delete_many(cls, ids: list[int]) -> None:
+        with database.transaction() as cursor:
+            cursor.executemany(
+                "DELETE FROM web_push_subscription WHERE id = ?;",
+                [(id,) for id in ids],
+            )
+
+
+RETRY_TOPIC = "webpush"
+
+
+@dataclass
+class WebPushDelivery:
+    """A push to one subscription that failed in a way worth retrying. Each
+    has its own outbox message, so retries reach only that subscription."""
+
+    id: appbase.database.INTPK
+    subscription_id: Annotated[
+        int, "REFERENCES web_push_subscription(id) ON UPDATE CASCADE ON DELETE CASCADE"
+    ]
+    payload: str
+    created_at: datetime
+
+    aio: ClassVar[database.AsyncRepository] = database.AsyncRepository()
+
+    @classmethod
+    def get_by_id(cls, id: int) -> Self | None:
+        return database.connection.table(cls).select().where(id=id).execute().one()
+
+    @classmethod
+    @database.writes
+    def defer_many(cls, subscription_ids: list[int], payload: str) -> None:
+        """Record a retry of `payload` for each subscription, retried by the
+        outbox after its first backoff."""
+        with database.transaction():
+            for subscription_id in subscription_ids:
+                rows = database.query(
+                    cls,
+                    """
+                    INSERT INTO web_push_delivery (subscription_id, payload, created_at)
+                    VALUES (?, ?, ?)
+                    RETURNING *;
+                    """,
+                    subscription_id,
+                    payload,
+                    utcnow(),
+                )
+                for delivery in list(rows):
+                    outbox.enqueue(
+                        RETRY_TOPIC, delivery.id, outbox.config().backoff_base
+                    )
+
+    @classmethod
+    @database.writes
+    def delete(cls, id: int) -> None:
+        database.connection.cursor().execute(
+            "DELETE FROM web_push_delivery WHERE id = ?;", (id,)
+        )
+
 
 api = APIRouter()
 
@@ -74,37 +153,182 @@ async def notify_submission(submission: ContactFormSubmission) -> None:
     )
 
 
+type Outcome = Literal["delivered", "gone", "retry", "failed"]
+
+
+@dataclass
+class DeliveryStats:
+    delivered: int = 0
+    failed: int = 0
+    retried: int = 0
+    pruned: int = 0
+    latencies: Latencies = field(default_factory=Latencies)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, outcome: Outcome, latency: float) -> None:
+        # Called from the delivery threads; `+=` on a field isn't atomic.
+        self.latencies.record(latency)
+        with self.lock:
+            match outcome:
+                case "delivered":
+                    self.delivered += 1
+                case "gone":
+                    self.pruned += 1
+                case "retry":
+                    self.retried += 1
+                case "failed":
+                    self.failed += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            counts = {
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "retried": self.retried,
+                "pruned": self.pruned,
+            }
+        return counts | {"latency_ms": self.latencies.summary()}
+
+
+stats = DeliveryStats()
+executor = ThreadPoolExecutor(
+    max_workers=config().concurrency, thread_name_prefix="wwwmin-webpush"
+)
+_sessions: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_vapid_headers: dict[str, tuple[dict[str, str], float]] = {}
+_vapid_headers_lock = threading.Lock()
+# Re-sign this long before the token expires, so it is never sent stale.
+VAPID_REFRESH_MARGIN = 300
+
+
+def _origin(endpoint: str) -> str:
+    parts = urlsplit(endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _authorization(endpoint: str) -> dict[str, str]:
+    """Return VAPID headers for the endpoint's push service, signing a new
+    token only when the cached one is about to expire."""
+    origin = _origin(endpoint)
+    now = time.time()
+    with _vapid_headers_lock:
+        cached = _vapid_headers.get(origin)
+        if cached is not None and now < cached[1] - VAPID_REFRESH_MARGIN:
+            return cached[0]
+        expires = int(now + config().vapid_token_lifetime.total_seconds())
+        headers = vapid.sign(
+            {"sub": config().vapid_subject, "aud": origin, "exp": expires}
+        )
+        _vapid_headers[origin] = (headers, expires)
+        return headers
+
+
+def _session(endpoint: str) -> requests.Session:
+    """Return the session for the endpoint's push service, so deliveries to
+    the same service reuse its connections."""
+    origin = _origin(endpoint)
+    with _sessions_lock:
+        if origin not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=config().concurrency)
+            session.mount(origin, adapter)
+            _sessions[origin] = session
+        return _sessions[origin]
+
+
+class Retryable(Exception):
+    """A push failed in a way that may succeed if tried again later."""
+
+
+def _send(subscription: WebPushSubscription, payload: str) -> None:
+    info = json.loads(subscription.subscription)
+    try:
+        webpush(
+            info,
+            data=payload,
+            headers=dict(_authorization(info["endpoint"])),
+            timeout=config().timeout,
+            requests_session=_session(info["endpoint"]),
+        )
+    except WebPushException as ex:
+        status = ex.response.status_code if ex.response is not None else None
+        if status is not None and (status == 429 or status >= 500):
+            raise Retryable(str(ex)) from ex
+        raise
+    except (requests.Timeout, requests.ConnectionError) as ex:
+        raise Retryable(str(ex)) from ex
+
+
+def _deliver(
+    subscription: WebPushSubscription, payload: str
+) -> tuple[Outcome, str | None]:
+    """Push `payload` to one subscription. Never raises: whatever goes wrong
+    is only that subscription's outcome."""
+    start = time.perf_counter()
+    outcome: Outcome = "delivered"
+    error = None
+    try:
+        _send(subscription, payload)
+    except Retryable as ex:
+        outcome, error = "retry", str(ex)
+    except WebPushException as ex:
+        status = ex.response.status_code if ex.response is not None else None
+        # The push service answers 404/410 once a subscription has expired
+        # or been revoked, so it will never succeed again.
+        outcome = "gone" if status in (404, 410) else "failed"
+        error = str(ex)
+    except Exception as ex:
+        outcome, error = "failed", f"{type(ex).__name__}: {ex}"
+    if error is not None:
+        print(f"Push to subscription {subscription.id} failed: {error}")
+    stats.record(outcome, time.perf_counter() - start)
+    return outcome, error
+
+
 async def notify_all(data: dict) -> None:
     payload = json.dumps(data)
-    vapid_pk = str(config().vapid_private_key_file.resolve())
-    for subscription in WebPushSubscription.iterall():
-        try:
-            webpush(
-                json.loads(subscription.subscription),
-                data=payload,
-                vapid_private_key=vapid_pk,
-                vapid_claims={"sub": "mailto:push@aidan.software"},
-            )
-        except WebPushException as ex:
-            if ex.response and ex.response.json():
-                extra = ex.response.json()
-                print(
-                    "Remote service replied with a {}:{}, {}",
-                    extra.code,
-                    extra.errno,
-                    extra.message,
-                )
+    subscriptions = await WebPushSubscription.aio.iterall()
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, _deliver, subscription, payload)
+            for subscription in subscriptions
+        )
+    )
+    outcomes = [outcome for outcome, _ in results]
+    gone = [s.id for s, outcome in zip(subscriptions, outcomes) if outcome == "gone"]
+    if gone:
+        await WebPushSubscription.aio.delete_many(gone)
+    retry = [s.id for s, outcome in zip(subscriptions, outcomes) if outcome == "retry"]
+    if retry:
+        await WebPushDelivery.aio.defer_many(retry, payload)
+
+
+async def retry_delivery(delivery: WebPushDelivery) -> None:
+    """Outbox handler for one deferred push. Raising leaves it to the outbox
+    to back off and try again, up to its `max_attempts`."""
+    subscription = await WebPushSubscription.aio.get_by_id(delivery.subscription_id)
+    if subscription is not None:
+        loop = asyncio.get_running_loop()
+        outcome, error = await loop.run_in_executor(
+            executor, _deliver, subscription, delivery.payload
+        )
+        if outcome == "retry":
+            raise Retryable(error)
+        if outcome == "gone":
+            await WebPushSubscription.aio.delete_many([subscription.id])
+    await WebPushDelivery.aio.delete(delivery.id)
 
 
 @api.get("/api/vapid-public-key", response_class=PlainTextResponse)
 async def get_vapid_public_key():
-    assert vapid.public_key is not None
-    return py_vapid.b64urlencode(
-        vapid.public_key.public_bytes(
-            py_vapid.serialization.Encoding.X962,
-            py_vapid.serialization.PublicFormat.UncompressedPoint,
-        )
-    )
+    return vapid_public_key
+
+
+@api.get("/api/webpush/stats")
+async def get_stats(_: security.authenticated):
+    return stats.snapshot()
 
 
 @api.post("/api/register-push-subscription", response_model=WebPushSubscription | None)
@@ -112,11 +336,20 @@ async def register_web_push_subscription(
     user: security.authenticated,
     subscription: Annotated[Any, Body()],
 ):
-    return WebPushSubscription.subscribe_user(user.id, subscription)
+    return await WebPushSubscription.aio.subscribe_user(user.id, subscription)
 
 
+database.connection.table(WebPushSubscription).create().if_not_exists().execute()
+database.connection.table(WebPushDelivery).create().if_not_exists().execute()
+outbox.register(RETRY_TOPIC, WebPushDelivery.get_by_id, lambda: [retry_delivery])
 if config().enabled:
-    database.connection.table(WebPushSubscription).create().if_not_exists().execute()
     config().vapid_private_key_file.parent.mkdir(parents=True, exist_ok=True)
     vapid = py_vapid.Vapid.from_file(config().vapid_private_key_file)
+    assert vapid.public_key is not None
+    vapid_public_key = py_vapid.b64urlencode(
+        vapid.public_key.public_bytes(
+            py_vapid.serialization.Encoding.X962,
+            py_vapid.serialization.PublicFormat.UncompressedPoint,
+        )
+    )
     submissions.ContactFormSubmission.subscribe(notify_submission)
@@ -0,0 +1,46 @@
+from pathlib import Path
+import re
+
+import requests
+from .utils import run_isolated, run_server, wait_for_healthcheck
+
+
+def test_fingerprinted_assets():
+    with run_server():
+        wait_for_healthcheck()
+        index = requests.get("http://localhost:8000/").text
+        match = re.search(r'href="(styles\.[0-9a-f]+\.css)"', index)
+        assert match
+        resp = requests.get(
+            f"http://localhost:8000/{match.group(1)}",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert resp.ok
+        assert resp.headers["content-encoding"] == "gzip"
+        assert "immutable" in resp.headers["cache-control"]
+        assert "wavey." in resp.text
+        assert requests.get("http://localhost:8000/worker.js").ok
+
+
+def _check_clean_build(source: Path, target: Path):
+    from wwwmin import static_assets
+
+    target.mkdir()
+    (target / "notes.txt").write_text("not ours")
+    source.mkdir()
+    (source / "app.js").write_text("console.log(1);" * 50)
+    first = static_assets.build(source, target)
+    (source / "app.js").write_text("console.log(2);" * 50)
+    second = static_assets.build(source, target)
+
+    old, new = first.url("app.js"), second.url("app.js")
+    assert old != new
+    assert (target / new).is_file() and (target / f"{new}.gz").is_file()
+    # The previous build's output goes; files it didn't write stay.
+    assert not (target / old).exists() and not (target / f"{old}.gz").exists()
+    assert (target / "app.js").read_text() == "console.log(2);" * 50
+    assert (target / "notes.txt").read_text() == "not ours"
+
+
+def test_clean_build(tmp_path):
+    run_isolated(_check_clean_build, tmp_path / "source", tmp_path / "build")
@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+
+import pytest
+
+from .utils import BASE_CONFIG, run_isolated
+
+
+def file_config(tmp_path) -> dict:
+    return BASE_CONFIG | {"database": {"uri": str(tmp_path / "database.sqlite3")}}
+
+
+def _create_items():
+    from wwwmin import database
+
+    @database.writes
+    def create():
+        with database.transaction() as cursor:
+            cursor.execute("CREATE TABLE item (id INTEGER PRIMARY KEY);")
+
+    create()
+
+
+def _count_items() -> int:
+    from wwwmin import database
+
+    return (
+        database.connection.cursor().execute("SELECT count(*) FROM item;").fetchone()[0]
+    )
+
+
+def _check_reads_during_write():
+    from wwwmin import database
+
+    _create_items()
+    started, release = threading.Event(), threading.Event()
+
+    @database.writes
+    def slow_write():
+        with database.transaction() as cursor:
+            cursor.execute("INSERT INTO item (id) VALUES (1);")
+            started.set()
+            release.wait(10)
+
+    async def read_concurrently() -> list[int]:
+        reads = asyncio.gather(*(database.run(_count_items) for _ in range(4)))
+        return await asyncio.wait_for(reads, 5)
+
+    with ThreadPoolExecutor(1) as executor:
+        writing = executor.submit(slow_write)
+        assert started.wait(10)
+        # Readers neither wait for the open write nor see it.
+        assert asyncio.run(read_concurrently()) == [0, 0, 0, 0]
+        release.set()
+        writing.result()
+    assert asyncio.run(database.run(_count_items)) == 1
+
+
+def test_reads_during_write(tmp_path):
+    run_isolated(_check_reads_during_write, config=file_config(tmp_path))
+
+
+def _check_writes_serialized():
+    from wwwmin import database
+
+    _create_items()
+    lock = threading.Lock()
+    running, most_running, threads = 0, 0, set()
+
+    @database.writes
+    def write(id: int):
+        nonlocal running, most_running
+        with lock:
+            running += 1
+            most_running = max(most_running, running)
+        threads.add(threading.current_thread().name)
+        with database.transaction() as cursor:
+            cursor.execute("INSERT INTO item (id) VALUES (?);", (id,))
+        time.sleep(0.001)
+        with lock:
+            running -= 1
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(write, range(50)))
+    assert most_running == 1
+    assert len(threads) == 1 and threads.pop().startswith("wwwmin-db-writer")
+    assert _count_items() == 50
+
+
+def test_writes_serialized(tmp_path):
+    run_isolated(_check_writes_serialized, config=file_config(tmp_path))
+
+
+def _check_close(uri: str):
+    from wwwmin import database
+
+    pool = database.ConnectionPool(uri)
+    assert pool.write(lambda: "written") == "written"
+    assert asyncio.run(pool.run(lambda: "read")) == "read"
+    pool.close()
+    assert not [
+        thread
+        for thread in threading.enumerate()
+        if thread.name.startswith("wwwmin-db-")
+    ]
+    with pytest.raises(RuntimeError):
+        pool.write(lambda: None)
+    with pytest.raises(RuntimeError):
+        asyncio.run(pool.run(lambda: None))
+
+
+def test_close(tmp_path):
+    config = file_config(tmp_path)
+    run_isolated(_check_close, config["database"]["uri"], config=config)
+
+
+def _check_async_repository():
+    from wwwmin.submissions import ContactFormSubmission
+
+    async def main():
+        created = await ContactFormSubmission.aio.create("test@example.com", "aio")
+        found = await ContactFormSubmission.aio.get_by_id(created.id)
+        # Lazy results come back as lists, read on the pool's thread.
+        active = await ContactFormSubmission.aio.active()
+        return created, found, active
+
+    created, found, active = asyncio.run(main())
+    assert found is not None and found.message == "aio"
+    assert isinstance(active, list)
+    assert [submission.id for submission in active] == [created.id]
+
+
+def test_async_repository(tmp_path):
+    run_isolated(_check_async_repository, config=file_config(tmp_path))
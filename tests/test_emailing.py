@@ -0,0 +1,31 @@
+import time
+
+import requests
+from .utils import run_server, run_smtp_server, wait_for_healthcheck, BASE_CONFIG
+
+EMAIL_CONFIG = BASE_CONFIG | {
+    "emailing": {
+        "enabled": True,
+        "host": "localhost",
+        "port": 8025,
+        "username": "wwwmin@localhost",
+        "to": "admin@localhost",
+        "starttls": False,
+    }
+}
+
+
+def test_submission_notifications():
+    with run_smtp_server() as smtp, run_server(config=EMAIL_CONFIG):
+        wait_for_healthcheck()
+        for i in range(2):
+            assert requests.post(
+                "http://localhost:8000/api/submissions",
+                {"email": "test@example.com", "message": f"emailed message {i}"},
+            ).ok
+        deadline = time.perf_counter() + 10
+        while len(smtp.messages) < 2 and time.perf_counter() < deadline:
+            time.sleep(0.1)
+        assert "emailed message 0" in smtp.messages[0]
+        assert "emailed message 1" in smtp.messages[1]
+        assert smtp.connections == 1
@@ -0,0 +1,30 @@
+from pathlib import Path
+import gzip
+import re
+
+from .utils import run_isolated
+
+
+def _check_export(outdir: Path):
+    from wwwmin import export
+
+    written = export.export(outdir)
+    assert sorted(path.name for path in written) == [
+        "closed.html",
+        "index.html",
+        "login.html",
+    ]
+    index = (outdir / "index.html").read_text()
+    match = re.search(r'href="(styles\.[0-9a-f]+\.css)"', index)
+    assert match
+    stylesheet = outdir / match.group(1)
+    assert "wavey." in stylesheet.read_text()
+    compressed = stylesheet.with_name(stylesheet.name + ".gz")
+    assert gzip.decompress(compressed.read_bytes()) == stylesheet.read_bytes()
+    assert (outdir / "styles.css").read_bytes() == stylesheet.read_bytes()
+    # Nothing changed, so nothing is rewritten.
+    assert export.export(outdir) == []
+
+
+def test_export(tmp_path):
+    run_isolated(_check_export, tmp_path / "site")
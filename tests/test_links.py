@@ -1,3 +1,5 @@
+import time
+
 import requests
 from .utils import run_server, wait_for_healthcheck, BASE_CONFIG
 
@@ -44,3 +46,113 @@ def test_api():
             headers=headers,
         ).json()
         assert test_value in requests.get("http://localhost:8000/").text
+
+
+def test_conditional_get():
+    with run_server():
+        wait_for_healthcheck()
+        resp = requests.get("http://localhost:8000/")
+        etag = resp.headers["etag"]
+        assert (
+            requests.get(
+                "http://localhost:8000/", headers={"If-None-Match": etag}
+            ).status_code
+            == 304
+        )
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+            headers={"content-type": "application/x-www-form-urlencoded"},
+        ).json()["access_token"]
+        requests.post(
+            "http://localhost:8000/api/links/categories",
+            data={"name": "personal"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        resp = requests.get("http://localhost:8000/", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["etag"] != etag
+
+
+def test_if_modified_since_after_restart(tmp_path):
+    config = BASE_CONFIG | {"database": {"uri": str(tmp_path / "database.sqlite3")}}
+    with run_server(config=config):
+        wait_for_healthcheck()
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+            headers={"content-type": "application/x-www-form-urlencoded"},
+        ).json()["access_token"]
+        requests.post(
+            "http://localhost:8000/api/links/categories",
+            data={"name": "personal"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        last_modified = requests.get("http://localhost:8000/").headers["last-modified"]
+    time.sleep(1)
+    # A restart may bring new templates or links config, so the links
+    # table alone cannot vouch for the page.
+    with run_server(config=config, user_credentials=[]):
+        wait_for_healthcheck()
+        resp = requests.get(
+            "http://localhost:8000/", headers={"If-Modified-Since": last_modified}
+        )
+        assert resp.status_code == 200
+        assert resp.headers["last-modified"] != last_modified
+        resp = requests.get(
+            "http://localhost:8000/",
+            headers={"If-Modified-Since": resp.headers["last-modified"]},
+        )
+        assert resp.status_code == 304
+
+
+def test_multiple_links_per_category():
+    with run_server():
+        wait_for_healthcheck()
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+            headers={"content-type": "application/x-www-form-urlencoded"},
+        ).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        cat = requests.post(
+            "http://localhost:8000/api/links/categories",
+            data={"name": "personal"},
+            headers=headers,
+        ).json()
+        for name in ["first-link-value", "second-link-value"]:
+            requests.post(
+                "http://localhost:8000/api/links",
+                data={"name": name, "href": name, "category_id": cat["id"]},
+                headers=headers,
+            )
+        page = requests.get("http://localhost:8000/").text
+        assert "first-link-value" in page
+        assert "second-link-value" in page
+
+
+def test_admin_links_by_category_id():
+    with run_server():
+        wait_for_healthcheck()
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+            headers={"content-type": "application/x-www-form-urlencoded"},
+        ).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        # Category names aren't unique; each category keeps its own links.
+        for name in ["first-link-value", "second-link-value"]:
+            cat = requests.post(
+                "http://localhost:8000/api/links/categories",
+                data={"name": "personal"},
+                headers=headers,
+            ).json()
+            requests.post(
+                "http://localhost:8000/api/links",
+                data={"name": name, "href": name, "category_id": cat["id"]},
+                headers=headers,
+            )
+        page = requests.get("http://localhost:8000/admin.html", headers=headers).text
+        first, second = page.split("<h2>personal</h2>")[1:]
+        assert "first-link-value" in first and "second-link-value" not in first
+        assert "second-link-value" in second
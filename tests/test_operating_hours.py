@@ -1,6 +1,8 @@
 from datetime import datetime
 import zoneinfo
 
+import toml
+
 from .utils import run_server, wait_for_healthcheck
 
 COMMON_CONFIG = {"database": {"uri": ":memory:"}, "operating_hours": {"enabled": True}}
@@ -20,3 +22,34 @@ def test_operating_hours_closed():
         data = wait_for_healthcheck()
         assert data.status_code == 503
         assert data.json()["status"] == "closed"
+        assert data.headers["Retry-After"] == str(15 * 60 * 60)
+
+
+def test_operating_hours_holiday():
+    config = {
+        **COMMON_CONFIG,
+        "operating_hours": {"enabled": True, "overrides": {"2024-06-26": None}},
+    }
+    with run_server(config=config, frozendt=OPEN_DT):
+        data = wait_for_healthcheck()
+        assert data.status_code == 503
+        assert data.json()["status"] == "closed"
+
+
+def test_operating_hours_holiday_toml():
+    config = toml.loads(
+        """
+        [database]
+        uri = ":memory:"
+
+        [operating_hours]
+        enabled = true
+
+        [operating_hours.overrides]
+        2024-06-26 = "closed"
+        """
+    )
+    with run_server(config=config, frozendt=OPEN_DT):
+        data = wait_for_healthcheck()
+        assert data.status_code == 503
+        assert data.json()["status"] == "closed"
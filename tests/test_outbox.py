@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+
+from .utils import BASE_CONFIG, run_isolated
+
+OUTBOX_CONFIG = BASE_CONFIG | {
+    "outbox": {"backoff_base": timedelta(minutes=1), "max_attempts": 3}
+}
+delivered: list[int] = []
+failures: list[str] = []
+
+
+async def _flaky(payload: int) -> None:
+    if failures:
+        raise RuntimeError(failures.pop(0))
+    delivered.append(payload)
+
+
+def _messages() -> list:
+    from wwwmin import database, outbox
+
+    return list(database.query(outbox.OutboxMessage, "SELECT * FROM outbox_message;"))
+
+
+def _make_due() -> None:
+    from wwwmin import database
+
+    database.connection.cursor().execute(
+        "UPDATE outbox_message SET next_attempt_at = ?;",
+        (datetime(2000, 1, 1, tzinfo=timezone.utc),),
+    )
+
+
+def _enqueue(payload_id: int) -> None:
+    from wwwmin import database, outbox
+
+    outbox.register("test", lambda id: id, lambda: [_flaky])
+    with database.transaction():
+        outbox.enqueue("test", payload_id)
+
+
+def _check_retry():
+    from wwwmin import outbox
+    from wwwmin.util import utcnow
+
+    _enqueue(7)
+    failures.append("first try")
+    assert asyncio.run(outbox.worker.drain()) == 1
+    (message,) = _messages()
+    assert (message.attempts, message.last_error) == (1, "RuntimeError: first try")
+    assert message.dead_at is None
+    wait = message.next_attempt_at - utcnow()
+    assert timedelta(seconds=55) < wait <= timedelta(minutes=1)
+    # Not due again until the backoff has passed.
+    assert asyncio.run(outbox.worker.drain()) == 0
+
+    failures.append("second try")
+    _make_due()
+    asyncio.run(outbox.worker.drain())
+    (message,) = _messages()
+    assert message.attempts == 2
+    assert timedelta(seconds=115) < message.next_attempt_at - utcnow()
+
+    _make_due()
+    assert asyncio.run(outbox.worker.drain()) == 1
+    assert delivered == [7]
+    assert _messages() == []
+
+
+def test_retry():
+    run_isolated(_check_retry, config=OUTBOX_CONFIG)
+
+
+def _check_dead_letter():
+    from wwwmin import outbox
+
+    _enqueue(7)
+    failures.extend(["one", "two", "three", "four"])
+    for _ in range(3):
+        _make_due()
+        assert asyncio.run(outbox.worker.drain()) == 1
+    (message,) = _messages()
+    assert message.attempts == 3
+    assert message.last_error == "RuntimeError: three"
+    assert message.dead_at is not None
+    # Dead messages are kept for inspection but never tried again.
+    _make_due()
+    assert asyncio.run(outbox.worker.drain()) == 0
+    assert delivered == []
+
+
+def test_dead_letter():
+    run_isolated(_check_dead_letter, config=OUTBOX_CONFIG)
+
+
+def _check_submission_enqueue():
+    from wwwmin import database, outbox
+    from wwwmin.submissions import ContactFormSubmission, NewSubmission
+
+    received_at = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    outbox.register("submission", ContactFormSubmission.get_by_id, lambda: [_flaky])
+    (submission,) = ContactFormSubmission.create_many(
+        [NewSubmission("test@example.com", "hello", received_at=received_at)]
+    )
+    (stored,) = (
+        database.connection.cursor()
+        .execute("SELECT received_at FROM contact_form_submission;")
+        .fetchone()
+    )
+    assert stored == database.adapt_datetime(received_at)
+    assert [(m.topic, m.payload_id) for m in _messages()] == [
+        ("submission", submission.id)
+    ]
+
+
+def test_submission_enqueue():
+    run_isolated(_check_submission_enqueue, config=OUTBOX_CONFIG)
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+import json
+import time
+
+from .utils import BASE_CONFIG, run_isolated
+
+
+def retention_config(tmp_path, archive_after: timedelta) -> dict:
+    return BASE_CONFIG | {
+        "retention": {"directory": tmp_path / "archive", "archive_after": archive_after}
+    }
+
+
+def _create(*messages: str) -> list:
+    from wwwmin.submissions import ContactFormSubmission, NewSubmission
+
+    received_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return ContactFormSubmission.create_many(
+        [
+            NewSubmission("test@example.com", message, received_at=received_at)
+            for message in messages
+        ]
+    )
+
+
+def _live_ids() -> list[int]:
+    from wwwmin import database
+
+    cursor = database.connection.cursor()
+    return [id for (id,) in cursor.execute("SELECT id FROM contact_form_submission;")]
+
+
+def _check_mixed_archive():
+    from wwwmin import retention
+    from wwwmin.submissions import ContactFormSubmission
+
+    single, bulk, kept = _create("single", "bulk", "kept")
+    ContactFormSubmission.archive(single.id)
+    assert ContactFormSubmission.set_archived_many(True, ids=[bulk.id]) == 1
+    time.sleep(0.01)
+    assert [count for _, count in retention.compact()] == [2]
+    assert _live_ids() == [kept.id]
+    for submission in (single, bulk):
+        cold = retention.get_cold(submission.id)
+        assert cold is not None and cold.archived_at is not None
+
+
+def test_mixed_archive(tmp_path):
+    run_isolated(_check_mixed_archive, config=retention_config(tmp_path, timedelta(0)))
+
+
+def _check_cutoff():
+    from wwwmin import data_export, migrations, retention
+    from wwwmin.submissions import ContactFormSubmission, NewSubmission
+    from wwwmin.util import utcnow
+
+    list(migrations.migrate())
+    old = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    expired, recent, active = ContactFormSubmission.create_many(
+        [
+            NewSubmission("test@example.com", "expired note", None, old, old),
+            NewSubmission("test@example.com", "recent note", None, old, utcnow()),
+            NewSubmission("test@example.com", "active note", None, old),
+        ]
+    )
+    assert [count for _, count in retention.compact()] == [1]
+    assert _live_ids() == [recent.id, active.id]
+    assert retention.get_cold(expired.id) == expired
+    assert retention.get_cold(recent.id) is None
+
+    # Search and export cover the live table; compacted rows are only
+    # fetched by id.
+    found = ContactFormSubmission.search("note")
+    assert sorted(s.id for s in found) == [recent.id, active.id]
+    exported = b"".join(data_export.export("submissions")).decode().splitlines()
+    assert [json.loads(row)["id"] for row in exported] == [recent.id, active.id]
+
+
+def test_cutoff(tmp_path):
+    run_isolated(_check_cutoff, config=retention_config(tmp_path, timedelta(days=30)))
+
+
+def _check_vacuum():
+    from wwwmin import database, retention
+    from wwwmin.submissions import ContactFormSubmission
+
+    def pragma(name: str) -> int:
+        return database.connection.cursor().execute(f"PRAGMA {name};").fetchone()[0]
+
+    assert pragma("auto_vacuum") == 2  # Incremental.
+    submissions = _create(*("x" * 4096 for _ in range(100)))
+    ContactFormSubmission.set_archived_many(True, ids=[s.id for s in submissions])
+    time.sleep(0.01)
+    pages = pragma("page_count")
+    assert [count for _, count in retention.compact()] == [100]
+    assert pragma("freelist_count") == 0
+    assert pragma("page_count") < pages
+
+
+def test_vacuum(tmp_path):
+    config = retention_config(tmp_path, timedelta(0))
+    config["database"] = {"uri": str(tmp_path / "database.sqlite3")}
+    run_isolated(_check_vacuum, config=config)
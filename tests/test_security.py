@@ -1,7 +1,9 @@
-import requests
+import time
 import urllib.parse
 
-from .utils import run_server, wait_for_healthcheck
+import requests
+
+from .utils import BASE_CONFIG, run_isolated, run_server, wait_for_healthcheck
 
 
 def test_authenticate_api():
@@ -30,3 +32,94 @@ def test_authenticate_form():
                 data={"username": "admin", "password": "password"},
             ).ok
             assert session.get("http://localhost:8000/admin.html").ok
+
+
+def test_token_cache():
+    with run_server():
+        wait_for_healthcheck()
+        token = requests.post(
+            url="http://localhost:8000/api/token",
+            data={"username": "admin", "password": "password"},
+        ).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        url = "http://localhost:8000/api/security/stats"
+        first = requests.get(url, headers=headers)
+        second = requests.get(url, headers=headers)
+        assert first.ok and second.ok
+        counts = [
+            (resp.json()["token_cache"]["misses"], resp.json()["token_cache"]["hits"])
+            for resp in (first, second)
+        ]
+        # One lookup per request: a miss that fills the cache, then a hit.
+        assert counts == [(1, 0), (1, 1)]
+
+
+def _cli(*args: str):
+    from wwwmin.__main__ import cli
+
+    cli(list(args))
+
+
+def test_token_cache_cli_delete(tmp_path):
+    config = BASE_CONFIG | {"database": {"uri": str(tmp_path / "database.sqlite3")}}
+    with run_server(config=config):
+        wait_for_healthcheck()
+        token = requests.post(
+            url="http://localhost:8000/api/token",
+            data={"username": "admin", "password": "password"},
+        ).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}", "accept": "application/json"}
+        url = "http://localhost:8000/api/security/stats"
+        assert requests.get(url, headers=headers).ok
+        assert requests.get(url, headers=headers).json()["token_cache"]["hits"] == 1
+        # The CLI runs in its own process, with its own token cache.
+        run_isolated(_cli, "user", "delete", "admin", config=config)
+        time.sleep(1)
+        assert requests.get(url, headers=headers).status_code == 401
+
+
+def test_login_rate_limit():
+    with run_server():
+        wait_for_healthcheck()
+        statuses = [
+            requests.post(
+                url="http://localhost:8000/api/token",
+                data={"username": "admin", "password": "wrong"},
+            ).status_code
+            for _ in range(6)
+        ]
+        assert statuses[:5] == [400] * 5
+        assert statuses[5] == 429
+
+
+def test_login_rate_limit_padded():
+    with run_server():
+        wait_for_healthcheck()
+        statuses = [
+            requests.post(
+                url="http://localhost:8000/api/token",
+                data={"username": "admin", "password": "wrong", "pad": "x" * 5000},
+            ).status_code
+            for _ in range(6)
+        ]
+        # Padding past the body limit must not skip the username's budget.
+        assert statuses == [413] * 6
+        resp = requests.post(
+            url="http://localhost:8000/api/token",
+            data={"username": "admin", "password": "password"},
+        )
+        assert resp.ok
+
+
+def test_login_rate_limit_multipart():
+    with run_server():
+        wait_for_healthcheck()
+        statuses = [
+            requests.post(
+                url="http://localhost:8000/api/token",
+                files={"username": (None, "Admin"), "password": (None, "wrong")},
+            ).status_code
+            for _ in range(6)
+        ]
+        assert statuses[:5] == [400] * 5
+        assert statuses[5] == 429
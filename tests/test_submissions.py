@@ -1,5 +1,9 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
 import requests
-from .utils import run_server, wait_for_healthcheck
+from .utils import run_isolated, run_server, wait_for_healthcheck
 
 
 def test_api():
@@ -13,3 +17,173 @@ def test_api():
         submission = requests.post("http://localhost:8000/api/submissions", data).json()
         assert submission["id"] == 1
         assert submission["message"] == "test message abc"
+
+
+def test_admin_pagination():
+    with run_server():
+        wait_for_healthcheck()
+        for i in range(3):
+            requests.post(
+                "http://localhost:8000/api/submissions",
+                {"email": "test@example.com", "message": f"paged message {i}"},
+            )
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+        ).json()["access_token"]
+        page = requests.get(
+            "http://localhost:8000/admin.html?limit=2",
+            headers={"Authorization": f"Bearer {token}"},
+        ).text
+        assert "paged message 2" in page
+        assert "paged message 0" not in page
+        assert "Older submissions" in page
+
+
+def test_api_pagination():
+    with run_server():
+        wait_for_healthcheck()
+        for i in range(3):
+            requests.post(
+                "http://localhost:8000/api/submissions",
+                {"email": "test@example.com", "message": f"message {i}"},
+            )
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+        ).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        resp = requests.get(
+            "http://localhost:8000/api/submissions?limit=2", headers=headers
+        )
+        assert [s["message"] for s in resp.json()] == ["message 2", "message 1"]
+        resp = requests.get(resp.links["next"]["url"], headers=headers)
+        assert [s["message"] for s in resp.json()] == ["message 0"]
+        assert "next" not in resp.links
+
+
+def test_group_commit():
+    with run_server():
+        wait_for_healthcheck()
+        with ThreadPoolExecutor(4) as pool:
+            created = list(
+                pool.map(
+                    lambda i: requests.post(
+                        "http://localhost:8000/api/submissions",
+                        {"email": "test@example.com", "message": f"burst {i}"},
+                    ).json(),
+                    range(4),
+                )
+            )
+        assert sorted(s["id"] for s in created) == [1, 2, 3, 4]
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+        ).json()["access_token"]
+        stats = requests.get(
+            "http://localhost:8000/api/submissions/ingest-stats",
+            headers={"Authorization": f"Bearer {token}"},
+        ).json()
+        assert stats["rows"] == 4
+        assert 1 <= stats["batches"] <= 4
+
+
+def test_search():
+    with run_server():
+        wait_for_healthcheck()
+        for message in ["invoice overdue", "lunch plans", "overdue library book"]:
+            requests.post(
+                "http://localhost:8000/api/submissions",
+                {"email": "test@example.com", "message": message},
+            )
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+        ).json()["access_token"]
+        resp = requests.get(
+            "http://localhost:8000/api/submissions/search",
+            params={"q": "overdue"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert resp.ok
+        assert sorted(s["message"] for s in resp.json()) == [
+            "invoice overdue",
+            "overdue library book",
+        ]
+
+
+def test_export_ndjson():
+    with run_server():
+        wait_for_healthcheck()
+        for i in range(2):
+            requests.post(
+                "http://localhost:8000/api/submissions",
+                {"email": "test@example.com", "message": f"exported {i}"},
+            )
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+        ).json()["access_token"]
+        resp = requests.get(
+            "http://localhost:8000/api/export/submissions",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in resp.text.splitlines()]
+        assert [row["message"] for row in rows] == ["exported 0", "exported 1"]
+
+
+def test_bulk_archive():
+    with run_server():
+        wait_for_healthcheck()
+        for i in range(3):
+            requests.post(
+                "http://localhost:8000/api/submissions",
+                {"email": "test@example.com", "message": f"spam {i}"},
+            )
+        token = requests.post(
+            "http://localhost:8000/api/token",
+            {"username": "admin", "password": "password"},
+        ).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        resp = requests.post(
+            "http://localhost:8000/api/submissions/archive/bulk",
+            json={"ids": [1, 2]},
+            headers=headers,
+        )
+        assert resp.json() == {"archived": 2}
+        active = requests.get(
+            "http://localhost:8000/api/submissions?status=active", headers=headers
+        ).json()
+        assert [s["id"] for s in active] == [3]
+
+
+def _check_pagination_ties():
+    from wwwmin.submissions import ContactFormSubmission, Cursor, NewSubmission
+
+    same = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    ContactFormSubmission.create_many(
+        [
+            NewSubmission(
+                "test@example.com", "earlier", received_at=same - timedelta(seconds=1)
+            ),
+            *(
+                NewSubmission("test@example.com", f"tie {i}", received_at=same)
+                for i in range(3)
+            ),
+            NewSubmission(
+                "test@example.com",
+                "later",
+                received_at=same + timedelta(microseconds=500),
+            ),
+        ]
+    )
+    messages, before = [], None
+    while page := ContactFormSubmission.page("all", before, limit=2):
+        messages.extend(s.message for s in page)
+        before = Cursor.decode(page[-1].cursor.encode())
+    assert messages == ["later", "tie 2", "tie 1", "tie 0", "earlier"]
+
+
+def test_pagination_ties():
+    run_isolated(_check_pagination_ties)
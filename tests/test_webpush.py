@@ -0,0 +1,132 @@
+from collections import Counter
+import asyncio
+import json
+import unittest.mock
+
+from pywebpush import WebPushException
+import requests
+
+from .utils import run_isolated
+
+pushes: Counter[str] = Counter()
+# Endpoints that fail with 503 this many more times before succeeding.
+unavailable: Counter[str] = Counter()
+
+
+def _response(status: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    return response
+
+
+def _fake_webpush(info: dict, **kwargs) -> requests.Response:
+    endpoint = info["endpoint"]
+    pushes[endpoint] += 1
+    if endpoint.endswith("/gone-404"):
+        raise WebPushException("Not Found", response=_response(404))
+    if endpoint.endswith("/gone-410"):
+        raise WebPushException("Gone", response=_response(410))
+    if endpoint.endswith("/rejected"):
+        raise WebPushException("Bad Request", response=_response(400))
+    if endpoint.endswith("/timeout"):
+        raise requests.Timeout("timed out")
+    if unavailable[endpoint]:
+        unavailable[endpoint] -= 1
+        raise WebPushException("Unavailable", response=_response(503))
+    return _response(201)
+
+
+def _subscribe(*subscriptions: str) -> dict[str, int]:
+    from wwwmin import security, webpush
+
+    user = security.User.create("admin", "password")
+    assert user is not None
+    ids = {}
+    for subscription in subscriptions:
+        created = webpush.WebPushSubscription.subscribe_user(user.id, subscription)
+        assert created is not None
+        ids[subscription] = created.id
+    return ids
+
+
+def _endpoint(name: str) -> str:
+    return json.dumps({"endpoint": f"https://push.example.com/{name}", "keys": {}})
+
+
+def _table(name: str) -> list[tuple]:
+    from wwwmin import database
+
+    return database.connection.cursor().execute(f"SELECT * FROM {name};").fetchall()
+
+
+def _make_due() -> None:
+    from wwwmin import database
+
+    database.connection.cursor().execute(
+        "UPDATE outbox_message SET next_attempt_at = '2000-01-01 00:00:00+00:00';"
+    )
+
+
+def _patched():
+    return unittest.mock.patch.multiple(
+        "wwwmin.webpush", webpush=_fake_webpush, _authorization=lambda endpoint: {}
+    )
+
+
+def _check_fan_out():
+    from wwwmin import webpush
+
+    ids = _subscribe(
+        *map(_endpoint, ["ok", "gone-404", "gone-410", "rejected", "timeout"]),
+        "not json",
+        json.dumps({"keys": {}}),
+    )
+    with _patched():
+        asyncio.run(webpush.notify_all({"title": "hello"}))
+    remaining = {id for id, *_ in _table("web_push_subscription")}
+    # Only the subscriptions the push service reported gone are removed.
+    assert remaining == set(ids.values()) - {
+        ids[_endpoint("gone-404")],
+        ids[_endpoint("gone-410")],
+    }
+    stats = webpush.stats.snapshot()
+    counts = [stats[key] for key in ("delivered", "failed", "retried", "pruned")]
+    assert counts == [1, 3, 1, 2]
+    ((_, subscription_id, payload, _),) = _table("web_push_delivery")
+    assert subscription_id == ids[_endpoint("timeout")]
+    assert json.loads(payload) == {"title": "hello"}
+
+
+def test_fan_out():
+    run_isolated(_check_fan_out)
+
+
+def _check_retry():
+    from wwwmin import outbox, webpush
+
+    ids = _subscribe(_endpoint("ok"), _endpoint("flaky"))
+    unavailable["https://push.example.com/flaky"] = 2
+    with _patched():
+        asyncio.run(webpush.notify_all({"title": "hello"}))
+        assert len(_table("outbox_message")) == 1
+        assert asyncio.run(outbox.worker.drain()) == 0  # Backing off.
+
+        _make_due()
+        assert asyncio.run(outbox.worker.drain()) == 1
+        ((_, topic, _, _, attempts, *_),) = _table("outbox_message")
+        assert (topic, attempts) == (webpush.RETRY_TOPIC, 1)
+
+        _make_due()
+        assert asyncio.run(outbox.worker.drain()) == 1
+    assert _table("outbox_message") == []
+    assert _table("web_push_delivery") == []
+    # Retries went to the failing subscription only.
+    assert pushes == {
+        "https://push.example.com/ok": 1,
+        "https://push.example.com/flaky": 3,
+    }
+    assert len(_table("web_push_subscription")) == len(ids)
+
+
+def test_retry():
+    run_isolated(_check_retry)
@@ -1,5 +1,7 @@
 import time
 import multiprocessing
+import pathlib
+import tempfile
 import functools
 import unittest.mock
 import contextlib
@@ -7,6 +9,8 @@ import datetime
 import zoneinfo
 import os
 import signal
+import socketserver
+import threading
 
 import requests
 
@@ -39,6 +43,19 @@ BASE_CONFIG = {
 }
 
 
+def scratch_config(config: dict, scratch: str) -> dict:
+    """`config` with build output written under `scratch`, rather than the
+    data directory, which defaults to the working directory."""
+    scratch_dirs = {
+        "assets": {"build_dir": pathlib.Path(scratch, "static-build")},
+        "templates": {"bytecode_cache_dir": pathlib.Path(scratch, "jinja-cache")},
+    }
+    return config | {
+        section: values | config.get(section, {})
+        for section, values in scratch_dirs.items()
+    }
+
+
 @contextlib.contextmanager
 def run_server(
     config: dict = BASE_CONFIG,
@@ -63,14 +80,90 @@ def run_server(
 
             wwwmin.server.serve()
 
-    proc = multiprocessing.Process(target=_run_target, args=(config, frozendt))
-    proc.start()
-    try:
-        yield
-    finally:
-        if proc.pid is not None:
-            os.kill(proc.pid, signal.SIGINT)
-        else:
+    with tempfile.TemporaryDirectory() as scratch:
+        proc = multiprocessing.Process(
+            target=_run_target, args=(scratch_config(config, scratch), frozendt)
+        )
+        proc.start()
+        try:
+            yield
+        finally:
+            if proc.pid is not None:
+                os.kill(proc.pid, signal.SIGINT)
+            else:
+                proc.terminate()
+            proc.join(10)
+            assert proc.exitcode == 0
+
+
+def _run_isolated_target(config, target, args):
+    import wwwmin.config
+
+    wwwmin.config.configconfig.reload(mapping=config)
+    target(*args)
+
+
+def run_isolated(target, *args, config: dict = BASE_CONFIG, timeout: int = 60):
+    """Run `target(*args)` in a fresh process with wwwmin configured from
+    `config`, so module-level state can't leak between tests. `target` must be
+    a module-level function; its assertions fail the test."""
+    with tempfile.TemporaryDirectory() as scratch:
+        proc = multiprocessing.Process(
+            target=_run_isolated_target,
+            args=(scratch_config(config, scratch), target, args),
+        )
+        proc.start()
+        proc.join(timeout)
+        if proc.exitcode is None:
             proc.terminate()
-        proc.join(10)
+            proc.join()
         assert proc.exitcode == 0
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    messages: list[str]
+    connections: int
+
+    def __init__(self, address: tuple[str, int]) -> None:
+        super().__init__(address, _SMTPHandler)
+        self.messages = []
+        self.connections = 0
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib to deliver a message."""
+
+    server: _SMTPServer
+
+    def handle(self):
+        self.server.connections += 1
+        self.wfile.write(b"220 localhost ESMTP\r\n")
+        for line in self.rfile:
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                self.wfile.write(b"250-localhost\r\n250 8BITMIME\r\n")
+            elif command == "DATA":
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                data = []
+                for line in self.rfile:
+                    if line == b".\r\n":
+                        break
+                    data.append(line)
+                self.server.messages.append(b"".join(data).decode())
+                self.wfile.write(b"250 OK\r\n")
+            elif command == "QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+@contextlib.contextmanager
+def run_smtp_server(port: int = 8025):
+    with _SMTPServer(("localhost", port)) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield server
+        finally:
+            server.shutdown()